@@ -1,10 +1,15 @@
 from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import uuid
 import time
+import functools
+import threading
 import datetime
 from datetime import timezone, timedelta
 
@@ -23,24 +28,137 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+def _locked_singleton(factory):
+    """
+    Build a service once per process, even when several threadpool workers resolve
+    the dependency at the same time (lru_cache does not lock while the factory runs).
+    The returned getter exposes is_initialized() to check for the instance without creating it.
+    """
+    lock = threading.Lock()
+    instance = None
+
+    @functools.wraps(factory)
+    def getter():
+        nonlocal instance
+        if instance is None:
+            with lock:
+                if instance is None:
+                    instance = factory()
+        return instance
+
+    getter.is_initialized = lambda: instance is not None
+    return getter
+
 # Dependency to get service instances
+@_locked_singleton
 def get_temporal_service():
     # In a real application, you'd load this from environment variables
     return TemporalService(db_path="./data/chat_history.db")
     
+@_locked_singleton
 def get_memory_service():
     # In a real application, you'd load this from environment variables
     return MemoryService(db_path="./data/vector_store", collection_name="semantic_memory")
     
+@_locked_singleton
 def get_main_llm_service():
     return MainLLMService()
     
+@_locked_singleton
 def get_temporal_agent_service():
     return TemporalAgentService()
     
+@_locked_singleton
 def get_memorize_agent_service():
     return MemorizeAgentService()
 
+async def _retrieve_temporal_context(
+    prompt: str,
+    sql_query: str,
+    temporal_service: TemporalService
+) -> List[Dict[str, Any]]:
+    """
+    Execute the Temporal Agent query and keep only the messages relevant to the prompt.
+    """
+    queried_messages = await run_in_threadpool(temporal_service.execute_sql_query, sql_query)
+
+    # Relevance Filtering
+    return await run_in_threadpool(
+        temporal_service.filter_relevant_messages,
+        prompt, 
+        queried_messages,
+        threshold=RELEVANT_MESSAGES_THRESHOLD  # Đặt rõ ngưỡng ở đây
+    )
+
+async def _retrieve_semantic_context(
+    query_for_semantic: str,
+    current_time: datetime.datetime,
+    memory_service: MemoryService,
+    memorize_agent: MemorizeAgentService
+) -> List[Dict[str, Any]]:
+    """
+    Retrieve semantic memories and filter them by importance considering time.
+    """
+    retrieved_important_info = await run_in_threadpool(
+        memory_service.query_similar_documents,
+        query_for_semantic, 
+        n_results=SIMILAR_DOCUMENTS_COUNT,
+        threshold=SIMILAR_DOCUMENTS_THRESHOLD  
+    )
+    for doc in retrieved_important_info:
+        logger.debug("Retrieved Document: %s --- Similarity Score: %s", doc['text'], doc['similarity'])
+
+    filtered_important_info_text = await memorize_agent.important_till_now_async(
+        retrieved_important_info, 
+        current_time
+    )
+    
+    # Format the filtered information as a list with a single item for the response model
+    if not filtered_important_info_text:
+        return []
+    return [{
+        'text': filtered_important_info_text,
+        'metadata': {'source': 'filtered_by_importance', 'datetime': current_time.isoformat()},
+        'id': str(uuid.uuid4())
+    }]
+
+async def _retrieve_context(
+    prompt: str,
+    current_time: datetime.datetime,
+    temporal_service: TemporalService,
+    memory_service: MemoryService,
+    temporal_agent: TemporalAgentService,
+    memorize_agent: MemorizeAgentService
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Gather recent history, temporal context and semantic context for a prompt.
+    
+    Returns:
+        Tuple of (recent messages, relevant temporal messages, filtered semantic information)
+    """
+    # Stage A: Temporal Agent SQL generation, semantic query generation
+    # and recent conversation history are independent of each other
+    sql_query, query_for_semantic, recent_messages = await asyncio.gather(
+        temporal_agent.generate_sql_query_async(prompt),
+        memorize_agent.determine_query_needs_async(prompt),
+        run_in_threadpool(temporal_service.get_recent_messages, count=RECENT_MESSAGES_COUNT)
+    )
+    logger.debug("Generated SQL Query: %s", sql_query)
+
+    # Stage B: Temporal retrieval + relevance filtering and semantic retrieval
+    # + importance filtering only depend on their own Stage A output
+    messages_relevant_from_time, filtered_important_info = await asyncio.gather(
+        _retrieve_temporal_context(prompt, sql_query, temporal_service),
+        _retrieve_semantic_context(query_for_semantic, current_time, memory_service, memorize_agent)
+    )
+    return recent_messages, messages_relevant_from_time, filtered_important_info
+
+def _format_sse(event: Dict[str, Any]) -> str:
+    """
+    Format an event as a Server-Sent Events message.
+    """
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
@@ -56,50 +174,23 @@ async def chat(
     This implements the Prompt Stage of the system.
     """
     try:
-        
-        # Step 2: Retrieve temporal information with Temporal Agent
-        sql_query = temporal_agent.generate_sql_query(request.prompt)
-        print(f"Generated SQL Query: {sql_query}")
-        queried_messages = temporal_service.execute_sql_query(sql_query)
-
-        # Step 3: Relevance Filtering
-        messages_relevant_from_time = temporal_service.filter_relevant_messages(
-            request.prompt, 
-            queried_messages,
-            threshold=RELEVANT_MESSAGES_THRESHOLD  # Đặt rõ ngưỡng ở đây
-        )
-            
-        # Step 4: Semantic Memory Retrieval
-        query_for_semantic = memorize_agent.determine_query_needs(request.prompt)
-        retrieved_important_info = memory_service.query_similar_documents(
-            query_for_semantic, 
-            n_results=SIMILAR_DOCUMENTS_COUNT,
-            threshold=SIMILAR_DOCUMENTS_THRESHOLD  
-        )
-        for doc in retrieved_important_info:
-            print(f"Retrieved Document: {doc['text']} --- Similarity Score: {doc['similarity']}")
-        # Step 4a: Filter retrieved information by importance considering time
+        # Every service call below is blocking (SQLite, ChromaDB, Gemini HTTP),
+        # so it is offloaded to the threadpool to keep the event loop free.
+        # The independent calls are fanned out so each stage costs its slowest branch.
         current_time = datetime.datetime.now(GMT7)
-        filtered_important_info_text = memorize_agent.important_till_now(
-            retrieved_important_info, 
-            current_time
+
+        # Stages A and B: Gather context from the memory systems
+        recent_messages, messages_relevant_from_time, filtered_important_info = await _retrieve_context(
+            request.prompt,
+            current_time,
+            temporal_service,
+            memory_service,
+            temporal_agent,
+            memorize_agent
         )
         
-        # Format the filtered information as a list with a single item for the response model
-        if filtered_important_info_text:
-            filtered_important_info = [{
-                'text': filtered_important_info_text,
-                'metadata': {'source': 'filtered_by_importance', 'datetime': current_time.isoformat()},
-                'id': str(uuid.uuid4())
-            }]
-        else:
-            filtered_important_info = []
-        
-        # Step 5: Recent Conversation History
-        recent_messages = temporal_service.get_recent_messages(count=RECENT_MESSAGES_COUNT)
-        
-        # Step 6: Generate Response with Main LLM
-        response_text = main_llm.generate_response(
+        # Stage C: Generate Response with Main LLM
+        response_text = await main_llm.generate_response_async(
             prompt=request.prompt,
             recent_messages=recent_messages,
             temporal_context=messages_relevant_from_time,
@@ -111,6 +202,7 @@ async def chat(
             save_memory_in_background,
             request.prompt,
             response_text,
+            current_time,
             temporal_service,
             memory_service,
             memorize_agent
@@ -130,6 +222,71 @@ async def chat(
             detail="An error occurred while processing your request."
         )
 
+@router.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    temporal_service: TemporalService = Depends(get_temporal_service),
+    memory_service: MemoryService = Depends(get_memory_service),
+    main_llm: MainLLMService = Depends(get_main_llm_service),
+    temporal_agent: TemporalAgentService = Depends(get_temporal_agent_service),
+    memorize_agent: MemorizeAgentService = Depends(get_memorize_agent_service)
+):
+    """
+    Process a chat request like /chat, but stream the response as Server-Sent Events.
+    Emits {"type": "chunk", "text": ...} events while the Main LLM generates and a final
+    {"type": "done", ...} event carrying the context used.
+    """
+    try:
+        current_time = datetime.datetime.now(GMT7)
+
+        recent_messages, messages_relevant_from_time, filtered_important_info = await _retrieve_context(
+            request.prompt,
+            current_time,
+            temporal_service,
+            memory_service,
+            temporal_agent,
+            memorize_agent
+        )
+            
+    except Exception as e:
+        logger.error(f"Error processing chat stream request: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="An error occurred while processing your request."
+        )
+
+    async def event_stream():
+        chunks = []
+        async for text in main_llm.generate_response_stream_async(
+            prompt=request.prompt,
+            recent_messages=recent_messages,
+            temporal_context=messages_relevant_from_time,
+            semantic_context=filtered_important_info
+        ):
+            chunks.append(text)
+            yield _format_sse({"type": "chunk", "text": text})
+        response_text = "".join(chunks)
+
+        yield _format_sse({
+            "type": "done",
+            "temporal_context": messages_relevant_from_time,
+            "semantic_context": filtered_important_info
+        })
+
+        # Save Stage: background tasks run once the stream has been fully sent
+        background_tasks.add_task(
+            save_memory_in_background,
+            request.prompt,
+            response_text,
+            current_time,
+            temporal_service,
+            memory_service,
+            memorize_agent
+        )
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @router.get("/chat/history")
 async def get_chat_history(
     temporal_service: TemporalService = Depends(get_temporal_service)
@@ -140,7 +297,7 @@ async def get_chat_history(
     """
     try:
         # Retrieve all messages from temporal memory
-        all_messages = temporal_service.get_all_messages()
+        all_messages = await run_in_threadpool(temporal_service.get_all_messages)
         
         return {
             "messages": all_messages
@@ -152,9 +309,10 @@ async def get_chat_history(
             detail="An error occurred while retrieving chat history."
         )
 
-async def save_memory_in_background(
+def save_memory_in_background(
     prompt: str,
     response: str,
+    current_time: datetime.datetime,
     temporal_service: TemporalService,
     memory_service: MemoryService,
     memorize_agent: MemorizeAgentService
@@ -162,34 +320,37 @@ async def save_memory_in_background(
     """
     Background task to save the conversation in both temporal and semantic memory.
     This implements the Save Stage of the system.
+    Declared as a plain function so Starlette runs it in the threadpool instead of
+    blocking the event loop with SQLite, ChromaDB and Gemini calls.
     """
     try:
 
-        # Step 1a: Save the prompt to temporal memory
-        temporal_service.save_interaction(
-            content=prompt,
-            role="user"
-        )
-
-        # Step 1b: Save the response to temporal memory
-        temporal_service.save_interaction(
-            content=response,
-            role="assistant"
-        )
+        # Step 1: Save the prompt and the response to temporal memory in one transaction
+        temporal_service.save_interactions_batch([
+            (prompt, "user"),
+            (response, "assistant")
+        ])
 
         # Step 2: Extract important information from the conversation
         extracted_info = memorize_agent.extract_from_conversation(prompt, response)
         
-        # Step 3: Save important information to semantic memory
-        for text, metadata in extracted_info:
-            try:
+        # Step 3: Save important information to semantic memory in one batched add
+        if extracted_info:
+            texts = [text for text, _ in extracted_info]
+            metadatas = [metadata for _, metadata in extracted_info]
+
+            # Every item is stamped with the time of the chat request
+            timestamp = current_time.timestamp()
+            datetime_iso = current_time.isoformat()
+            for metadata in metadatas:
                 # Add timestamp and datetime to metadata
                 metadata.update({
-                    "timestamp": time.time(),
-                    "datetime": datetime.datetime.now(GMT7).isoformat()
+                    "timestamp": timestamp,
+                    "datetime": datetime_iso
                 })
-                
-                memory_service.add_document(text, metadata)
+
+            try:
+                memory_service.add_documents_batch(texts, metadatas)
             except Exception as e:
                 logger.error(f"Error storing extracted information in semantic memory: {e}")
                 
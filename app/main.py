@@ -1,29 +1,33 @@
 import os
 import logging
+import anyio.to_thread
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-from app.api.chat_router import router as chat_router
+from app.api.chat_router import router as chat_router, get_temporal_service
 from app.services.init_db import init_all_databases
+from app.services.config import THREADPOOL_TOKENS
 
-# Configure logging
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging (set LOG_LEVEL=WARNING in production)
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file
-load_dotenv()
-
 # Create FastAPI app
 app = FastAPI(
     title="Conversational AI with Hybrid Memory",
     description="A conversational AI system leveraging both temporal and semantic memory",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -58,6 +62,9 @@ async def startup_event():
     """
     logger.info("Starting up the application")
     
+    # Raise the threadpool limit so blocking service calls do not saturate it
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_TOKENS
+    
     # Ensure data directories exist
     os.makedirs("data", exist_ok=True)
     os.makedirs("data/vector_store", exist_ok=True)
@@ -81,4 +88,7 @@ async def shutdown_event():
     Clean up resources when the application shuts down.
     """
     logger.info("Shutting down the application")
-    # Any cleanup code would go here
\ No newline at end of file
+    
+    # Refresh planner statistics and close the database if the temporal service was used
+    if get_temporal_service.is_initialized():
+        get_temporal_service().close()
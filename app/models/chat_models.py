@@ -1,24 +1,28 @@
-from typing import Optional, List, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class ChatRequest(BaseModel):
     """
     Model for chat requests coming into the API.
     """
+    model_config = ConfigDict(extra="ignore", arbitrary_types_allowed=False)
+    
     prompt: str = Field(..., description="User's input text prompt")
     
     
 class ChatResponse(BaseModel):
     """
     Model for responses returned by the API.
+    Context entries are plain dicts and are not validated field by field.
     """
+    model_config = ConfigDict(extra="ignore", arbitrary_types_allowed=False)
+    
     response_text: str = Field(..., description="AI generated response text")
     
     # Optional fields for returning context information used in response
-    temporal_context: Optional[List[Dict[str, Any]]] = Field(None, 
+    temporal_context: list[dict] | None = Field(None, 
         description="Temporal information retrieved from history")
-    semantic_context: Optional[List[Dict[str, Any]]] = Field(None, 
+    semantic_context: list[dict] | None = Field(None, 
         description="Semantic information retrieved from vector store")
 
 
@@ -26,7 +30,9 @@ class MemoryEntry(BaseModel):
     """
     Model for entries to be stored in memory.
     """
+    model_config = ConfigDict(extra="ignore", arbitrary_types_allowed=False)
+    
     text: str = Field(..., description="Text content to be stored")
     source_type: str = Field(..., description="Source of the entry (e.g., 'prompt', 'response', 'extraction')")
-    metadata: Dict[str, Any] = Field(default_factory=dict, description="Additional metadata for the entry")
-    timestamp: Optional[float] = None
\ No newline at end of file
+    metadata: dict = Field(default_factory=dict, description="Additional metadata for the entry")
+    timestamp: float | None = None
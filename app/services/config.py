@@ -11,6 +11,57 @@ SIMILAR_DOCUMENTS_COUNT = 6  # Number of similar documents to retrieve
 
 
 RELEVANT_MESSAGES_THRESHOLD = 0.6  # Threshold for filter_relevant_messages
+RELEVANT_MESSAGES_TOP_K = 32  # Most relevant messages kept by filter_relevant_messages
+TEMPORAL_EMBEDDING_CAPACITY = 1024  # Message embeddings allocated up front; the matrix doubles as it fills
+
+
+# SQLite pragmas applied to every temporal memory connection
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Readers do not block the writer
+    "PRAGMA synchronous=NORMAL",  # Safe with WAL, one fsync per checkpoint instead of per commit
+    "PRAGMA busy_timeout=5000",  # Wait up to 5s for a lock instead of failing
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256 MB memory-mapped I/O
+    "PRAGMA cache_size=-65536",  # 64 MB page cache
+)
+SQLITE_CACHED_STATEMENTS = 256  # Compiled statements kept per connection (sqlite3 default is 128)
+SQLITE_READER_POOL_SIZE = 8  # Read-only connections shared by all worker threads
+
+
+# Semantic memory collection HNSW index configuration
+HNSW_M = 24  # Graph degree; higher improves recall at the cost of memory
+HNSW_EF_CONSTRUCTION = 128  # Candidate list size while building the graph
+HNSW_EF_SEARCH = 128  # Candidate list size at query time
+
+
+# Semantic memory collection metadata; embeddings are unit-norm, so inner product equals cosine.
+# Chroma's HNSW defaults (search_ef=10) are tuned for tiny collections, so set the graph explicitly
+SEMANTIC_COLLECTION_METADATA = {
+    "hnsw:space": "ip",
+    "hnsw:M": HNSW_M,
+    "hnsw:construction_ef": HNSW_EF_CONSTRUCTION,
+    "hnsw:search_ef": HNSW_EF_SEARCH,
+}
+
+
+# Embedding model configuration
+EMBEDDING_MAX_LENGTH = 256  # Max tokens per text; batches are padded only to their longest text
+EMBEDDING_BATCH_SIZE = 32  # Number of texts per forward pass
+EMBEDDING_COMPILE = True  # Wrap the model with torch.compile when running on CUDA
+EMBEDDING_MIN_BUCKET = 16  # Compiled models pad batches to power-of-two lengths from here up to EMBEDDING_MAX_LENGTH
+EMBEDDING_CACHE_SIZE = 4096  # Number of text embeddings kept in the in-process LRU cache
+EMBEDDING_MAX_CONCURRENCY = 2  # Model forward passes allowed at once across request threads
+
+
+# Concurrency configuration
+THREADPOOL_TOKENS = 200  # Max worker threads for blocking service calls (AnyIO default is 40)
+
+
+# Main LLM context caching of the static system prompt
+MAIN_LLM_CONTEXT_CACHE = True
+MAIN_LLM_CONTEXT_CACHE_TTL = 3600  # seconds
+MAIN_LLM_CONTEXT_CACHE_RETRY = 30  # Seconds before retrying a failed cache creation; doubles per failure
+MAIN_LLM_CONTEXT_CACHE_MAX_RETRY = 1800  # Upper bound on the retry delay
 
 
 # Main LLM model configuration
@@ -1,43 +1,224 @@
-import torch
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
 import numpy as np
-from transformers import AutoTokenizer, AutoModel
 from chromadb.utils import embedding_functions
 
+from app.services.config import (
+    EMBEDDING_MAX_LENGTH, EMBEDDING_MIN_BUCKET, EMBEDDING_BATCH_SIZE, EMBEDDING_COMPILE, EMBEDDING_CACHE_SIZE,
+    EMBEDDING_MAX_CONCURRENCY,
+)
+
+logger = logging.getLogger(__name__)
+
 
 class VietnameseSBERTEmbeddingFunction(embedding_functions.EmbeddingFunction):
     """
     Custom embedding function for ChromaDB that uses Vietnamese SBERT model.
+    Returned embeddings are L2-normalized (unit-norm).
     """
     def __init__(self, model=None, tokenizer=None):
         """
         Initialize the embedding function with the Vietnamese SBERT model.
-        
+
         Args:
             model: Optional pre-loaded model instance
             tokenizer: Optional pre-loaded tokenizer instance
         """
+        # torch and transformers take seconds to import; load them only when the model is built
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
         if model is None or tokenizer is None:
             # Load model and tokenizer if not provided
-            self.tokenizer = AutoTokenizer.from_pretrained("keepitreal/vietnamese-sbert")
+            self.tokenizer = AutoTokenizer.from_pretrained("keepitreal/vietnamese-sbert", use_fast=True)
             self.model = AutoModel.from_pretrained("keepitreal/vietnamese-sbert")
         else:
             # Use provided model and tokenizer
             self.model = model
             self.tokenizer = tokenizer
-        
+
+        self.embedding_dim = self.model.config.hidden_size
+
+        # Run in half precision on GPU when available (bfloat16 where supported), FP32 on CPU
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        if self.device.type == "cuda":
+            dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            self.model = self.model.to(self.device, dtype=dtype)
+        else:
+            self.model = self.model.to(self.device)
+        self.model.eval()
+
+        # Compile the forward pass into fused kernels. CUDA graphs ("reduce-overhead") are
+        # recorded per calling thread, and requests embed from many threadpool threads, so
+        # they are left out rather than re-recorded in every thread
+        self._compiled = False
+        if EMBEDDING_COMPILE and self.device.type == "cuda" and hasattr(torch, "compile"):
+            eager_model = self.model
+            self.model = torch.compile(self.model, mode="max-autotune-no-cudagraphs", fullgraph=False)
+            self._compiled = True
+            try:
+                # Compilation happens on the first forward; do it now so no request pays for it
+                self._embed_batch(["warmup"])
+            except Exception as e:
+                logger.warning(f"torch.compile warm-up failed, using the eager model: {e}")
+                self.model = eager_model
+                self._compiled = False
+
+        # LRU cache of embeddings keyed by a 16-byte digest of the text
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # Services call this from many threadpool threads; bound the concurrent forward passes
+        # so they queue instead of oversubscribing the CPU's intra-op threads or the GPU
+        self._forward_slots = threading.BoundedSemaphore(EMBEDDING_MAX_CONCURRENCY)
+
     def __call__(self, texts):
         """
         Generate embeddings for the given texts.
-        
+
+        Embeddings are served from an in-process LRU cache when the same text
+        was embedded before; only the remaining texts go through the model.
+        ChromaDB wraps this method and rejects an empty result, so callers must
+        not pass an empty list.
+
+        Args:
+            texts: Non-empty list of text strings to embed
+
+        Returns:
+            list: One unit-norm numpy embedding per text, as converted by ChromaDB's wrapper
+        """
+        keys = [hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest() for text in texts]
+
+        # Split inputs into cache hits and unique misses
+        cached = {}
+        missing = {}
+        with self._cache_lock:
+            for key, text in zip(keys, texts):
+                if key in cached or key in missing:
+                    continue
+                embedding = self._cache.get(key)
+                if embedding is None:
+                    missing[key] = text
+                else:
+                    self._cache.move_to_end(key)
+                    cached[key] = embedding
+
+        if missing:
+            with self._forward_slots:
+                new_embeddings = self._embed(list(missing.values()))
+            with self._cache_lock:
+                for key, embedding in zip(missing.keys(), new_embeddings):
+                    # Copy the row so the cache entry does not keep its whole batch array alive
+                    embedding = embedding.copy()
+                    cached[key] = embedding
+                    self._cache[key] = embedding
+                    self._cache.move_to_end(key)
+                while len(self._cache) > EMBEDDING_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+
+        # Stitch the results back together in the original order
+        return np.stack([cached[key] for key in keys])
+
+    def _embed(self, texts):
+        """
+        Embed texts with the model.
+
+        Texts are sorted by length and embedded in batches so each batch is only
+        padded to its own longest text, then returned in the original order.
+
         Args:
             texts: List of text strings to embed
-            
+
         Returns:
             numpy.ndarray: Array of embeddings
         """
-        inputs = self.tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=256)
-        with torch.no_grad():
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        sorted_texts = [texts[i] for i in order]
+
+        batches = []
+        for start in range(0, len(sorted_texts), EMBEDDING_BATCH_SIZE):
+            batches.append(self._embed_batch(sorted_texts[start:start + EMBEDDING_BATCH_SIZE]))
+        sorted_embeddings = np.concatenate(batches, axis=0)
+
+        # Restore the original order of the inputs
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
+    def _embed_batch(self, texts):
+        """
+        Run a single forward pass over a batch of texts.
+
+        Args:
+            texts: List of text strings to embed
+
+        Returns:
+            numpy.ndarray: Array of embeddings for the batch
+        """
+        import torch
+
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=EMBEDDING_MAX_LENGTH)
+        if self._compiled:
+            inputs = self._pad_to_bucket(inputs)
+        inputs = {key: value.to(self.device) for key, value in inputs.items()}
+        with torch.inference_mode():
             outputs = self.model(**inputs)
-        # Get embeddings from the CLS token (first token)
-        embeddings = outputs.last_hidden_state[:, 0, :].cpu().numpy()
-        return embeddings
\ No newline at end of file
+        # Get embeddings from the CLS token (first token), dropping any bucket padding rows
+        embeddings = outputs.last_hidden_state[:len(texts), 0, :].float().cpu().numpy()
+        # L2-normalize once here so every downstream similarity is a plain dot product
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+
+    def _pad_to_bucket(self, inputs):
+        """
+        Pad a tokenized batch to the next power-of-two batch size and sequence length.
+
+        A compiled model specializes its kernels on the input shape, so bucketing
+        both dimensions lets a handful of compiled shapes serve every request.
+        Extra rows repeat the first text and are dropped after the forward pass.
+
+        Args:
+            inputs: Tokenizer output padded to the longest text in the batch
+
+        Returns:
+            dict: Tokenizer output padded to the bucket shape
+        """
+        import torch
+
+        batch, seq_len = inputs["input_ids"].shape
+        batch_bucket = max(batch, min(1 << (batch - 1).bit_length(), EMBEDDING_BATCH_SIZE))
+        seq_bucket = max(seq_len, min(max(EMBEDDING_MIN_BUCKET, 1 << (seq_len - 1).bit_length()), EMBEDDING_MAX_LENGTH))
+        pad_id = self.tokenizer.pad_token_id or 0
+        padded = {}
+        for key, value in inputs.items():
+            if seq_bucket > seq_len:
+                value = torch.nn.functional.pad(value, (0, seq_bucket - seq_len), value=pad_id if key == "input_ids" else 0)
+            if batch_bucket > batch:
+                value = torch.cat([value, value[:1].expand(batch_bucket - batch, -1)])
+            padded[key] = value
+        return padded
+
+
+# Shared embedding function, created on first use
+_embedding_function: Optional[VietnameseSBERTEmbeddingFunction] = None
+_embedding_function_lock = threading.Lock()
+
+def get_embedding_function() -> VietnameseSBERTEmbeddingFunction:
+    """
+    Get the shared embedding function, loading the model on first use.
+    Every service embeds through the same instance, so the model and its
+    embedding cache are only held in memory once. Loading happens under a lock
+    so services created concurrently do not each load their own copy.
+
+    Returns:
+        VietnameseSBERTEmbeddingFunction: The shared embedding function
+    """
+    global _embedding_function
+    if _embedding_function is None:
+        with _embedding_function_lock:
+            if _embedding_function is None:
+                _embedding_function = VietnameseSBERTEmbeddingFunction()
+    return _embedding_function
@@ -10,6 +10,9 @@ import chromadb
 from typing import Optional
 from dotenv import load_dotenv
 
+from app.services.config import SEMANTIC_COLLECTION_METADATA, SQLITE_PRAGMAS
+from app.services.embedding_functions import get_embedding_function
+
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -35,6 +38,8 @@ def init_temporal_db(db_path: Optional[str] = None) -> bool:
         
         # Connect to database (creates it if it doesn't exist)
         conn = sqlite3.connect(db_path)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
         cursor = conn.cursor()
         
         # Create conversations table if it doesn't exist
@@ -44,7 +49,8 @@ def init_temporal_db(db_path: Optional[str] = None) -> bool:
             role TEXT NOT NULL,
             content TEXT NOT NULL,
             timestamp REAL NOT NULL,
-            metadata TEXT
+            metadata TEXT,
+            embedding BLOB
         )
         ''')
         
@@ -86,12 +92,17 @@ def init_semantic_db(db_path: Optional[str] = None, collection_name: Optional[st
         # Initialize ChromaDB client
         client = chromadb.PersistentClient(path=db_path)
         
-        # Check if collection exists, if not create it
+        # Check if collection exists, if not create it with the same
+        # embedding function and distance metric as MemoryService
         try:
             collection = client.get_collection(name=collection_name)
             logger.info(f"Using existing collection: {collection_name}")
         except Exception:
-            collection = client.create_collection(name=collection_name)
+            collection = client.create_collection(
+                name=collection_name,
+                embedding_function=get_embedding_function(),
+                metadata=SEMANTIC_COLLECTION_METADATA
+            )
             logger.info(f"Created new collection: {collection_name}")
         
         logger.info(f"Semantic database initialized successfully at: {db_path}")
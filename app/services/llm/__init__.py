@@ -4,11 +4,32 @@ LLM services for AI responses, temporal and memory operations.
 
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional
+import asyncio
 import logging
 import os
+import threading
+
+import google.generativeai as genai
 
 logger = logging.getLogger(__name__)
 
+# API keys already passed to genai.configure in this process
+_configured_keys: set = set()
+_configure_lock = threading.Lock()
+
+def ensure_configured(api_key: Optional[str]) -> None:
+    """
+    Configure the Gemini SDK with an API key, once per distinct key.
+    
+    Args:
+        api_key: API key for Google Gemini API
+    """
+    with _configure_lock:
+        if api_key in _configured_keys:
+            return
+        genai.configure(api_key=api_key)
+        _configured_keys.add(api_key)
+
 class BaseLLMService(ABC):
     """
     Base class for LLM services.
@@ -38,4 +59,18 @@ class BaseLLMService(ABC):
         Returns:
             Generated response text
         """
-        pass
\ No newline at end of file
+        pass
+        
+    async def generate_response_async(self, prompt: str, **kwargs) -> str:
+        """
+        Generate a response from the LLM without blocking the event loop.
+        Subclasses with a native async client should override this.
+        
+        Args:
+            prompt: The text prompt to send to the LLM
+            **kwargs: Additional parameters to pass to the LLM API
+            
+        Returns:
+            Generated response text
+        """
+        return await asyncio.to_thread(self.generate_response, prompt, **kwargs)
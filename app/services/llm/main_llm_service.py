@@ -1,22 +1,69 @@
+import asyncio
 import logging
 import os
-from typing import List, Dict, Any, Optional
+import re
+import time
+import threading
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, AsyncIterator
 import google.generativeai as genai
 from google.generativeai import types
+from google.generativeai import caching
 import datetime
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from app.services.llm import BaseLLMService
-from app.services.config import MAIN_LLM_CONFIG
+from app.services.llm import BaseLLMService, ensure_configured
+from app.services.config import (
+    MAIN_LLM_CONFIG, MAIN_LLM_CONTEXT_CACHE, MAIN_LLM_CONTEXT_CACHE_TTL,
+    MAIN_LLM_CONTEXT_CACHE_RETRY, MAIN_LLM_CONTEXT_CACHE_MAX_RETRY
+)
 
 logger = logging.getLogger(__name__)
 
+# Fallback used when the system prompt file is missing or unreadable
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant with hybrid memory capabilities."
+
+# Context cache creation errors that retrying cannot fix: the system prompt is below the
+# model's minimum cacheable token count, or the model does not support context caching
+_PERMANENT_CACHE_ERROR_RE = re.compile(
+    r"min_total_token_count|minimum token count|too small|not supported|does not support|unsupported",
+    re.IGNORECASE
+)
+
+@lru_cache(maxsize=1)
+def _load_system_prompt() -> str:
+    """
+    Load the system prompt from a file. The file is read once per process.
+    
+    Returns:
+        System prompt text loaded from file
+    """
+    try:
+        # Get the absolute path to the system prompt file in the LLM folder
+        prompt_path = os.path.join(os.path.dirname(__file__), "private_main_system_prompt.txt")
+        
+        # Check if file exists
+        if not os.path.exists(prompt_path):
+            logger.warning(f"System prompt file not found at: {prompt_path}")
+            return DEFAULT_SYSTEM_PROMPT
+        
+        # Read the prompt from file
+        with open(prompt_path, "r") as f:
+            return f.read().strip()
+            
+    except Exception as e:
+        logger.error(f"Error loading system prompt: {e}")
+        return DEFAULT_SYSTEM_PROMPT
+
 class MainLLMService(BaseLLMService):
     """
     Service for the main LLM that generates responses to user prompts.
     This uses a more powerful model than the specialized agents.
     """
     
+    # Response returned when generation fails
+    ERROR_RESPONSE = "I apologize, but I encountered an error processing your request. Please try again."
+    
     def __init__(self, api_key: Optional[str] = None, model: str = "gemini-2.0-flash"):
         """
         Initialize the Main LLM service.
@@ -26,35 +73,72 @@ class MainLLMService(BaseLLMService):
             model: Model name to use
         """
         super().__init__(api_key)
-        print(self.api_key)
-        genai.configure(api_key=self.api_key)
+        ensure_configured(self.api_key)
         self.model_name = model
         # Load the main system prompt from file
-        self.base_system_prompt = self._load_system_prompt()
+        self.base_system_prompt = _load_system_prompt()
+        
+        # The model is built once with the static system prompt; per-turn context is
+        # sent with the request so the system instruction stays identical across turns
+        self.model = genai.GenerativeModel(
+            self.model_name, 
+            generation_config=MAIN_LLM_CONFIG, 
+            system_instruction=self.base_system_prompt
+        )
+        
+        # Gemini context cache holding the system prompt, created lazily and refreshed before it expires
+        self._context_caching = MAIN_LLM_CONTEXT_CACHE
+        self._cached_model = None
+        self._cache_expires_at = 0.0
+        self._cache_retry_at = 0.0
+        self._cache_retry_delay = MAIN_LLM_CONTEXT_CACHE_RETRY
+        self._cache_lock = threading.Lock()
         
-    def _load_system_prompt(self) -> str:
+    def _get_model(self) -> genai.GenerativeModel:
         """
-        Load the system prompt from a file.
+        Get the model to generate with, preferring one backed by a Gemini context cache
+        of the system prompt so it is not re-sent and re-processed on every turn.
+        Falls back to the plain model while the cache is unavailable. A failed creation is
+        retried after an exponential backoff; caching is only turned off for good when the
+        system prompt is below the model's minimum cacheable size or the model does not
+        support caching.
         
         Returns:
-            System prompt text loaded from file
+            Generative model instance
         """
-        try:
-            # Get the absolute path to the system prompt file in the LLM folder
-            prompt_path = os.path.join(os.path.dirname(__file__), "private_main_system_prompt.txt")
-            
-            # Check if file exists
-            if not os.path.exists(prompt_path):
-                logger.warning(f"System prompt file not found at: {prompt_path}")
-                return "You are a helpful AI assistant with hybrid memory capabilities."
+        if not self._context_caching:
+            return self.model
             
-            # Read the prompt from file
-            with open(prompt_path, "r") as f:
-                return f.read().strip()
-                
-        except Exception as e:
-            logger.error(f"Error loading system prompt: {e}")
-            return "You are a helpful AI assistant with hybrid memory capabilities."
+        with self._cache_lock:
+            now = time.time()
+            # Refresh a minute early so in-flight requests never hit an expired cache
+            needs_refresh = self._cached_model is None or now > self._cache_expires_at - 60
+            if needs_refresh and now >= self._cache_retry_at:
+                try:
+                    cached_content = caching.CachedContent.create(
+                        model=self.model_name,
+                        system_instruction=self.base_system_prompt,
+                        ttl=timedelta(seconds=MAIN_LLM_CONTEXT_CACHE_TTL)
+                    )
+                    self._cached_model = genai.GenerativeModel.from_cached_content(
+                        cached_content=cached_content,
+                        generation_config=MAIN_LLM_CONFIG
+                    )
+                    self._cache_expires_at = time.time() + MAIN_LLM_CONTEXT_CACHE_TTL
+                    self._cache_retry_delay = MAIN_LLM_CONTEXT_CACHE_RETRY
+                except Exception as e:
+                    if _PERMANENT_CACHE_ERROR_RE.search(str(e)):
+                        logger.warning(f"Gemini context caching unavailable, sending the system prompt with each request: {e}")
+                        self._context_caching = False
+                        return self.model
+                    logger.warning(f"Could not create Gemini context cache, retrying in {self._cache_retry_delay}s: {e}")
+                    self._cache_retry_at = now + self._cache_retry_delay
+                    self._cache_retry_delay = min(self._cache_retry_delay * 2, MAIN_LLM_CONTEXT_CACHE_MAX_RETRY)
+                    
+            # A cache that failed to refresh is still usable until it actually expires
+            if self._cached_model is not None and now < self._cache_expires_at:
+                return self._cached_model
+            return self.model
         
     def generate_response(self, 
                          prompt: str, 
@@ -77,76 +161,144 @@ class MainLLMService(BaseLLMService):
         """
         try:
 
-            # Format the context information into a complete system prompt
-            system_instruction = self._build_system_prompt(
+            # Format the per-turn context information
+            context_prompt = self._build_context_prompt(
                 recent_messages, 
                 temporal_context, 
                 semantic_context
             )
-            
-            # Use the configuration from config.py
-            self.model = genai.GenerativeModel(
-                self.model_name, 
-                generation_config=MAIN_LLM_CONFIG, 
-                system_instruction=system_instruction
-            )
 
-            # Generate the response using generate_content
-            response = self.model.generate_content(
-                contents=prompt
+            # Generate the response using generate_content, sending the context
+            # and the user's prompt as separate parts of the same turn
+            response = self._get_model().generate_content(
+                contents=[context_prompt, prompt]
             )
             
             return response.text
             
         except Exception as e:
             logger.error(f"Error generating response from main LLM: {e}")
-            return "I apologize, but I encountered an error processing your request. Please try again."
+            return self.ERROR_RESPONSE
             
-    def _build_system_prompt(self,
-                           recent_messages: List[Dict[str, Any]] = None,
-                           temporal_context: List[Dict[str, Any]] = None,
-                           semantic_context: List[Dict[str, Any]] = None) -> str:
+    async def generate_response_async(self, 
+                                      prompt: str, 
+                                      recent_messages: List[Dict[str, Any]] = None,
+                                      temporal_context: List[Dict[str, Any]] = None,
+                                      semantic_context: List[Dict[str, Any]] = None,
+                                      **kwargs) -> str:
         """
-        Build a system prompt that includes all context information.
+        Generate a response like generate_response, using the Gemini async client.
         
         Args:
+            prompt: User's prompt text
             recent_messages: List of recent conversation messages
             temporal_context: Temporal context information retrieved from history
             semantic_context: Semantic context information retrieved from memory
+            **kwargs: Additional parameters to pass to the Gemini API
             
         Returns:
-            Formatted system prompt text
+            Generated response text
         """
-        # Start with the base system prompt loaded from file
-        system_prompt = self.base_system_prompt
+        try:
+            context_prompt = self._build_context_prompt(
+                recent_messages, 
+                temporal_context, 
+                semantic_context
+            )
+            
+            # Refreshing the context cache is a blocking call, keep it off the event loop
+            model = await asyncio.to_thread(self._get_model)
+            response = await model.generate_content_async(
+                contents=[context_prompt, prompt]
+            )
+            
+            return response.text
+            
+        except Exception as e:
+            logger.error(f"Error generating response from main LLM: {e}")
+            return self.ERROR_RESPONSE
+            
+    async def generate_response_stream_async(self, 
+                                             prompt: str, 
+                                             recent_messages: List[Dict[str, Any]] = None,
+                                             temporal_context: List[Dict[str, Any]] = None,
+                                             semantic_context: List[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Generate a response like generate_response, yielding text chunks as the Gemini async client streams them.
         
-        # Add time context
-        system_prompt += "\n\n## Current Date and Time Context:\n"
-        system_prompt += f"\n- Current Date: {datetime.now().strftime('%Y-%m-%d')}"
-        system_prompt += f"\n- Current Time: {datetime.now().strftime('%H:%M:%S')}"
-        system_prompt += f"\n- Current Day: {datetime.now().strftime('%A')}"
+        Args:
+            prompt: User's prompt text
+            recent_messages: List of recent conversation messages
+            temporal_context: Temporal context information retrieved from history
+            semantic_context: Semantic context information retrieved from memory
+            
+        Yields:
+            Chunks of generated response text
+        """
+        try:
+            context_prompt = self._build_context_prompt(
+                recent_messages, 
+                temporal_context, 
+                semantic_context
+            )
+            
+            model = await asyncio.to_thread(self._get_model)
+            response = await model.generate_content_async(
+                contents=[context_prompt, prompt],
+                stream=True
+            )
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+                    
+        except Exception as e:
+            logger.error(f"Error streaming response from main LLM: {e}")
+            yield self.ERROR_RESPONSE
+            
+    def _build_context_prompt(self,
+                              recent_messages: List[Dict[str, Any]] = None,
+                              temporal_context: List[Dict[str, Any]] = None,
+                              semantic_context: List[Dict[str, Any]] = None) -> str:
+        """
+        Build the per-turn context block sent alongside the user's prompt.
+        
+        Args:
+            recent_messages: List of recent conversation messages
+            temporal_context: Temporal context information retrieved from history
+            semantic_context: Semantic context information retrieved from memory
+            
+        Returns:
+            Formatted context text
+        """
+        # Collect the pieces and join once instead of growing a string with +=
+        now = datetime.now()
+        parts = [
+            "## Current Date and Time Context:\n",
+            f"\n- Current Date: {now.strftime('%Y-%m-%d')}",
+            f"\n- Current Time: {now.strftime('%H:%M:%S')}",
+            f"\n- Current Day: {now.strftime('%A')}"
+        ]
 
         # Add recent conversation history
-        if recent_messages and len(recent_messages) > 0:
-            system_prompt += "\n\n## Recent Conversation History:\n"
+        if recent_messages:
+            parts.append("\n\n## Recent Conversation History:\n")
+            role_titles = {}
             for msg in recent_messages:
                 role = msg.get('role', 'unknown')
-                content = msg.get('content', '')
-                system_prompt += f"\n{role.title()}: {content}"
+                title = role_titles.get(role)
+                if title is None:
+                    title = role_titles[role] = role.title()
+                parts.append(f"\n{title}: {msg.get('content', '')}")
         
         # Add temporal context
-        if temporal_context and len(temporal_context) > 0:
-            system_prompt += "\n\n## Relevant Time-Based Context:\n"
-            for i, ctx in enumerate(temporal_context):
-                content = ctx.get('content', '')
-                dt = ctx.get('datetime', '')
-                system_prompt += f"\n{i+1}. ({dt}) {content}"
+        if temporal_context:
+            parts.append("\n\n## Relevant Time-Based Context:\n")
+            for i, ctx in enumerate(temporal_context, 1):
+                parts.append(f"\n{i}. ({ctx.get('datetime', '')}) {ctx.get('content', '')}")
         
         # Add semantic context
-        if semantic_context and len(semantic_context) > 0:
-            system_prompt += "\n\n## Relevant Semantic Knowledge:\n"
-            for i, ctx in enumerate(semantic_context):
-                text = ctx.get('text', '')
-                system_prompt += f"\n{i+1}. {text}"
-        # print(f"System Prompt: {system_prompt}")   
-        return system_prompt
\ No newline at end of file
+        if semantic_context:
+            parts.append("\n\n## Relevant Semantic Knowledge:\n")
+            for i, ctx in enumerate(semantic_context, 1):
+                parts.append(f"\n{i}. {ctx.get('text', '')}")
+        return "".join(parts)
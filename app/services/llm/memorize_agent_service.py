@@ -1,12 +1,46 @@
 import logging
+import math
+import re
 from typing import Optional, Dict, Any, List, Tuple
 import google.generativeai as genai
 import datetime
+import numpy as np
 
-from app.services.llm import BaseLLMService
+from app.services.llm import BaseLLMService, ensure_configured
 
 logger = logging.getLogger(__name__)
 
+# One information item per line: skips headings and "Important..." lead-ins and
+# strips list markers such as "1. ", "12) " or "- ". Surrounding whitespace is
+# any Unicode whitespace (NBSP included), matching str.strip()
+_ITEM_RE = re.compile(r'^[^\S\n]*(?!#|Important)(?:\d+[.)][^\S\n]+|-[^\S\n]+)?(\S.*?)[^\S\n]*$', re.MULTILINE)
+
+# Fixed parts of the prompt used to re-evaluate retrieved documents
+_IMPORTANCE_PROMPT_HEADER = """Below are pieces of information from memory with their age in days. 
+                    Some information may be outdated or less relevant now.
+                    Please select and prioritize the most important, relevant, and current information:
+
+"""
+_IMPORTANCE_PROMPT_FOOTER = "\nProvide only still relevant information."
+
+def _document_timestamp(metadata: Dict[str, Any]) -> float:
+    """
+    Get the creation time of a document from its metadata as a unix timestamp.
+    
+    Args:
+        metadata: Document metadata with a "timestamp" and/or ISO "datetime"
+        
+    Returns:
+        Unix timestamp, or NaN if the metadata has no usable time
+    """
+    timestamp = metadata.get("timestamp")
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        return datetime.datetime.fromisoformat(metadata["datetime"]).timestamp()
+    except (KeyError, ValueError, TypeError):
+        return np.nan
+
 class MemorizeAgentService(BaseLLMService):
     """
     Service for the Memorize Agent that identifies and extracts important information.
@@ -22,10 +56,8 @@ class MemorizeAgentService(BaseLLMService):
             model: Model name to use
         """
         super().__init__(api_key, api_key_env_name="GEMINI_API_KEY2")
-            # Format the system prompt for information extraction
-        print(self.api_key)
         # Configure the Gemini API
-        genai.configure(api_key=self.api_key)
+        ensure_configured(self.api_key)
         
         system_prompt = self._build_system_prompt()
         self.model = genai.GenerativeModel(model, system_instruction=system_prompt)
@@ -55,6 +87,30 @@ class MemorizeAgentService(BaseLLMService):
             logger.error(f"Error extracting information from memorize agent: {e}")
             return ""
             
+    async def generate_response_async(self, prompt: str, **kwargs) -> str:
+        """
+        Generate a response identifying important information in the prompt,
+        using the Gemini async client.
+        
+        Args:
+            prompt: Text to analyze for important information
+            **kwargs: Additional parameters to pass to the Gemini API
+            
+        Returns:
+            Generated response text with important information
+        """
+        try:
+            response = await self.model.generate_content_async(
+                f"Text to analyze: {prompt}",
+                **kwargs
+            )
+            
+            return response.text
+            
+        except Exception as e:
+            logger.error(f"Error extracting information from memorize agent: {e}")
+            return ""
+            
     def extract_important_information(self, text: str) -> List[str]:
         """
         Extract important pieces of information from a text.
@@ -65,23 +121,23 @@ class MemorizeAgentService(BaseLLMService):
         Returns:
             List of important information items
         """
-        response = self.generate_response(text)
+        return self._parse_information_items(self.generate_response(text))
         
-        # Parse the response into separate information items
+    def _parse_information_items(self, response: str) -> List[str]:
+        """
+        Parse the agent's response into separate information items.
+        
+        Args:
+            response: Response text from the agent
+            
+        Returns:
+            List of important information items
+        """
         if not response:
             return []
             
-        # Split by numbered items or newlines
-        items = []
-        for line in response.strip().split('\n'):
-            line = line.strip()
-            if line and not line.startswith('#') and not line.startswith('Important'):
-                # Remove numbering if present (e.g., "1. ", "- ")
-                cleaned_line = line
-                if len(line) > 2 and (line[0].isdigit() and line[1:3] in ['. ', ') ']) or line.startswith('- '):
-                    cleaned_line = line[line.find(' ')+1:]
-                items.append(cleaned_line)
-        return items
+        # One item per non-empty line, numbering stripped
+        return _ITEM_RE.findall(response)
         
     def determine_query_needs(self, prompt: str) -> str:
         """
@@ -95,10 +151,26 @@ class MemorizeAgentService(BaseLLMService):
         """
         enhanced_prompt = f"What important information might be needed to answer this query: '{prompt}'? Please response only keywords no addtional text."
         response = self.generate_response(enhanced_prompt)
-        print(response)
+        logger.debug("determine_query_needs response: %s", response)
         # The response should be usable as a query for semantic memory
         return response
         
+    async def determine_query_needs_async(self, prompt: str) -> str:
+        """
+        Determine what important information may be needed to answer a prompt,
+        using the Gemini async client.
+        
+        Args:
+            prompt: User's prompt text
+            
+        Returns:
+            A query for searching semantic memory
+        """
+        enhanced_prompt = f"What important information might be needed to answer this query: '{prompt}'? Please response only keywords no addtional text."
+        response = await self.generate_response_async(enhanced_prompt)
+        logger.debug("determine_query_needs response: %s", response)
+        return response
+        
     def extract_from_conversation(self, prompt: str, response: str) -> List[Tuple[str, Dict[str, Any]]]:
         """
         Extract important information from a conversation turn (prompt and response).
@@ -110,13 +182,27 @@ class MemorizeAgentService(BaseLLMService):
         Returns:
             List of (text, metadata) tuples for storage in semantic memory
         """
-        # Combine prompt and response for context
-        conversation = f"User: {prompt}\n\nAssistant: {response}"
-        
         # Ask the agent to extract important information
-        extracted_info = self.extract_important_information(conversation)
+        extracted_info = self.extract_important_information(self._format_conversation(prompt, response))
+        return self._format_extracted(prompt, extracted_info)
+        
+    def _format_conversation(self, prompt: str, response: str) -> str:
+        """
+        Combine a prompt and response into one conversation text for analysis.
+        """
+        return f"User: {prompt}\n\nAssistant: {response}"
+        
+    def _format_extracted(self, prompt: str, extracted_info: List[str]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Attach storage metadata to information extracted from a conversation turn.
         
-        # Format for storage
+        Args:
+            prompt: User's prompt text of the turn
+            extracted_info: Information items extracted from the turn
+            
+        Returns:
+            List of (text, metadata) tuples for storage in semantic memory
+        """
         result = []
         for i, info in enumerate(extracted_info):
             metadata = {
@@ -126,8 +212,8 @@ class MemorizeAgentService(BaseLLMService):
                 "original_prompt": prompt[:100],  # Store truncated original prompt in metadata
                 "datetime": datetime.datetime.now().isoformat()  # Add datetime in ISO format
             }
-            print(f"Extracted info: {info}, Metadata: {metadata}\n")
             result.append((info, metadata))
+        logger.debug("extract_from_conversation result: %s", result)
         return result
         
     def important_till_now(self, retrieved_documents: List[Dict[str, Any]], current_time: datetime.datetime = None) -> str:
@@ -144,57 +230,86 @@ class MemorizeAgentService(BaseLLMService):
         if not retrieved_documents:
             return ""
             
-        if current_time is None:
-            current_time = datetime.datetime.now()
+        texts = [doc.get("text", "") for doc in retrieved_documents]
+        days_old = self._days_old(retrieved_documents, current_time)
+        
+        # Generate response that filters and prioritizes information
+        try:
+            response = self.model.generate_content(self._build_importance_prompt(texts, days_old))
+            return response.text.strip()
+        except Exception as e:
+            logger.error(f"Error evaluating importance of retrieved documents: {e}")
+            return self._most_recent_text(texts, days_old)
             
-        # Prepare documents with their age information for the LLM
-        documents_with_age = []
-        for doc in retrieved_documents:
-            doc_datetime = None
-            try:
-                # Try to parse the datetime from the metadata
-                if "datetime" in doc.get("metadata", {}):
-                    doc_datetime = datetime.datetime.fromisoformat(doc["metadata"]["datetime"])
-                elif "timestamp" in doc.get("metadata", {}):
-                    doc_datetime = datetime.datetime.fromtimestamp(doc["metadata"]["timestamp"])
-            except (ValueError, TypeError):
-                pass
-                
-            # Calculate days since the document was created
-            days_old = None
-            if doc_datetime:
-                delta = current_time - doc_datetime
-                days_old = delta.days
-                
-            documents_with_age.append({
-                "text": doc.get("text", ""),
-                "days_old": days_old,
-                "metadata": doc.get("metadata", {})
-            })
+    async def important_till_now_async(self, retrieved_documents: List[Dict[str, Any]], current_time: datetime.datetime = None) -> str:
+        """
+        Evaluate the importance of retrieved documents like important_till_now, using the Gemini async client.
+        
+        Args:
+            retrieved_documents: List of documents retrieved from semantic memory
+            current_time: Current datetime (defaults to now if not provided)
             
-        # Prepare prompt for the LLM to evaluate importance
-        prompt = """Below are pieces of information from memory with their age in days. 
-                    Some information may be outdated or less relevant now.
-                    Please select and prioritize the most important, relevant, and current information:
-
-"""
-        for i, doc in enumerate(documents_with_age, 1):
-            days_info = f" (from {doc['days_old']} days ago)" if doc['days_old'] is not None else " (unknown age)"
-            prompt += f"{i}. {doc['text']}{days_info}\n"
+        Returns:
+            String containing filtered and prioritized important information
+        """
+        if not retrieved_documents:
+            return ""
             
-        prompt += "\nProvide only still relevant information."
+        texts = [doc.get("text", "") for doc in retrieved_documents]
+        days_old = self._days_old(retrieved_documents, current_time)
         
-        # Generate response that filters and prioritizes information
         try:
-            response = self.model.generate_content(prompt)
+            response = await self.model.generate_content_async(self._build_importance_prompt(texts, days_old))
             return response.text.strip()
         except Exception as e:
             logger.error(f"Error evaluating importance of retrieved documents: {e}")
-            # Fallback: return the text of the most recent document
-            if documents_with_age:
-                sorted_docs = sorted(documents_with_age, key=lambda x: x["days_old"] if x["days_old"] is not None else float('inf'))
-                return sorted_docs[0]["text"]
-            return ""
+            return self._most_recent_text(texts, days_old)
+            
+    def _days_old(self, retrieved_documents: List[Dict[str, Any]], current_time: datetime.datetime = None) -> np.ndarray:
+        """
+        Compute the age in whole days of each retrieved document in one vectorized pass.
+        
+        Args:
+            retrieved_documents: List of documents retrieved from semantic memory
+            current_time: Current datetime (defaults to now if not provided)
+            
+        Returns:
+            Array of ages in days, NaN where the document has no usable time
+        """
+        if current_time is None:
+            current_time = datetime.datetime.now()
+            
+        timestamps = np.fromiter(
+            (_document_timestamp(doc.get("metadata", {})) for doc in retrieved_documents),
+            dtype=np.float64,
+            count=len(retrieved_documents)
+        )
+        return np.floor((current_time.timestamp() - timestamps) / 86400)
+        
+    def _build_importance_prompt(self, texts: List[str], days_old: np.ndarray) -> str:
+        """
+        Build the prompt asking the agent to select still relevant information.
+        
+        Args:
+            texts: Text of each document
+            days_old: Age in days of each document, NaN where unknown
+            
+        Returns:
+            Prompt text
+        """
+        # Prepare prompt for the LLM to evaluate importance
+        ages = [f" (from {int(age)} days ago)" if not math.isnan(age) else " (unknown age)" for age in days_old.tolist()]
+        body = "\n".join([f"{i}. {text}{age}" for i, (text, age) in enumerate(zip(texts, ages), 1)])
+        return "".join((_IMPORTANCE_PROMPT_HEADER, body, "\n", _IMPORTANCE_PROMPT_FOOTER))
+        
+    def _most_recent_text(self, texts: List[str], days_old: np.ndarray) -> str:
+        """
+        Fallback when the evaluation fails: return the text of the most recent document.
+        """
+        if texts:
+            # Documents of unknown age sort last
+            return texts[int(np.argmin(np.nan_to_num(days_old, nan=np.inf)))]
+        return ""
         
     def _build_system_prompt(self) -> str:
         """
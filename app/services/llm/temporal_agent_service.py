@@ -1,16 +1,149 @@
 import logging
-from typing import Optional, Dict, Any
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Optional, Tuple
 import google.generativeai as genai
 from datetime import datetime, timedelta, timezone
 import json
 
-from app.services.llm import BaseLLMService
+from app.services.llm import BaseLLMService, ensure_configured
 
 # Define GMT+7 timezone
 GMT7 = timezone(timedelta(hours=7))
 
 logger = logging.getLogger(__name__)
 
+_SECS_PER_DAY = 86400
+
+# Default query for today if no time references found - use GMT+7 format
+_DEFAULT_TODAY_TPL = "SELECT id, datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations WHERE timestamp >= {0} AND timestamp <= {1} ORDER BY timestamp ASC"
+
+# Words and date patterns that may refer to a time period (English and Vietnamese).
+# Prompts without any of them get the default today query without calling the LLM;
+# false positives only cost the LLM call that would have been made anyway
+_TIME_RE = re.compile(
+    r"\b(?:today|tonight|yesterday|tomorrow|last|next|previous|recent(?:ly)?|earlier|ago|since|"
+    r"days?|weeks?|weekends?|months?|years?|hours?|minutes?|morning|afternoon|evening|night|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|"
+    r"january|february|march|april|may|june|july|august|september|october|november|december|"
+    r"hôm|mai|ngày|tuần|tháng|năm|giờ|phút|sáng|trưa|chiều|tối|đêm|trước|gần đây|lúc|"
+    r"\d{1,2}[/-]\d{1,2}|\d{4})\b",
+    re.IGNORECASE
+)
+
+# Vietnamese time phrases without diacritics, matched against an accent-stripped copy of the
+# prompt so "hom qua" or "tuan truoc" typed on a keyboard without a Vietnamese layout still
+# count. Only phrases are listed: bare unaccented words like "toi" or "nam" also mean "I" or
+# "south", and would send almost every Vietnamese prompt through the LLM
+_UNACCENTED_TIME_RE = re.compile(
+    r"\b(?:hom (?:nay|qua|kia)|ngay (?:mai|kia|mot)|"
+    r"(?:ngay|tuan|thang|nam) (?:truoc|sau|nay|qua|toi|roi)|"
+    r"(?:sang|trua|chieu|toi|dem) (?:nay|qua|mai)|"
+    r"thu (?:hai|ba|tu|nam|sau|bay)|chu nhat|cuoi tuan|gan day|luc nay|"
+    r"\d+ (?:ngay|tuan|thang|nam|gio|phut))\b",
+    re.IGNORECASE
+)
+
+def _strip_accents(text: str) -> str:
+    """
+    Remove Vietnamese diacritics from a text, mapping đ to d.
+    
+    Args:
+        text: Text to strip
+        
+    Returns:
+        Text with combining marks removed
+    """
+    decomposed = unicodedata.normalize("NFD", text.replace("đ", "d").replace("Đ", "D"))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+def has_time_reference(prompt: str) -> bool:
+    """
+    Check whether a prompt may refer to a time period, with or without Vietnamese diacritics.
+    
+    Args:
+        prompt: User's message
+        
+    Returns:
+        True if the prompt contains a time word, time phrase or date pattern
+    """
+    return (_TIME_RE.search(unicodedata.normalize("NFC", prompt)) is not None
+            or _UNACCENTED_TIME_RE.search(_strip_accents(prompt)) is not None)
+
+# A valid generated query selects the GMT+7 datetime and role from conversations
+_VALID_RE = re.compile(
+    r"select (?=.*datetime\(timestamp, 'unixepoch', '\+7 hours'\) as datetime)(?=.*role)(?=.*from conversations)",
+    re.IGNORECASE | re.DOTALL
+)
+# "content" appearing before the first "where" (or anywhere, when there is no where clause)
+_CONTENT_BEFORE_WHERE_RE = re.compile(r"(?:(?!where).)*content", re.IGNORECASE | re.DOTALL)
+
+# System prompt for SQL generation; it only depends on the current day, so the
+# model built from it is reused for every request of that day
+_SYSTEM_PROMPT_TEMPLATE = """You are a specialized SQL query generator for retrieving conversation records from a database.
+        Your task is to convert user messages into precise SQL queries for a conversations database.
+
+        TODAY'S DATE: {current_date} ({current_day}, {current_month} {current_year})
+        START OF TODAY (UNIX TIMESTAMP): {start_of_day_timestamp}
+
+        DATABASE SCHEMA:
+        - Table name: conversations
+        - Columns: id (INTEGER, message id), timestamp (REAL, unix timestamp), role (TEXT, either 'user' or 'assistant'), content (TEXT, message content)
+
+        CRITICAL INSTRUCTIONS:
+        1. Look for ANY time references in the user's message (today, yesterday, last week, May 10, etc.)
+        2. If NO time references are found in the message, ALWAYS return EXACTLY this query:
+           {default_today_query}
+        3. If time references ARE found, generate a time-specific query following these rules:
+           - Use "SELECT id, datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations"
+           - Include WHERE clauses to filter by the appropriate time range
+           - Use ORDER BY timestamp DESC LIMIT 10
+
+        IMPORTANT:
+        - Your output must be ONLY the SQL query with NO additional text
+        - Do not include explanations, comments, or markdown in your response
+        - When there are no time references, default to today's query EXACTLY as provided
+        - NEVER modify the default today query's format - it must be used exactly as shown
+        - ALWAYS include the id and content columns in all queries
+        - ALWAYS use '+7 hours' in the datetime function to use GMT+7 timezone
+
+        EXAMPLES:
+
+        User message: "What do you know about climate change?"
+        SQL (no time reference): {default_today_query}
+
+        User message: "What did we talk about yesterday?"
+        SQL (has time reference): SELECT id, datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations WHERE timestamp >= {start_of_yesterday_timestamp} AND timestamp < {start_of_day_timestamp} ORDER BY timestamp DESC LIMIT 10
+
+        User message: "Tell me what I asked about in May"
+        SQL (has time reference): SELECT id, datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations WHERE timestamp >= strftime('%s', '2025-05-01 00:00:00') AND timestamp < strftime('%s', '2025-06-01 00:00:00') ORDER BY timestamp DESC LIMIT 10"""
+
+
+@lru_cache(maxsize=2)
+def _get_sql_model(model_name: str, start_timestamp: int) -> genai.GenerativeModel:
+    """
+    Get the SQL generation model for a day, building it and its system prompt on first use.
+    
+    Args:
+        model_name: Model name to use
+        start_timestamp: Unix timestamp of the start of the day in GMT+7
+        
+    Returns:
+        Generative model instance
+    """
+    start_of_day = datetime.fromtimestamp(start_timestamp, tz=GMT7)
+    system_prompt = _SYSTEM_PROMPT_TEMPLATE.format_map({
+        "current_date": start_of_day.strftime("%Y-%m-%d"),
+        "current_day": start_of_day.strftime("%A"),
+        "current_month": start_of_day.strftime("%B"),
+        "current_year": start_of_day.year,
+        "start_of_day_timestamp": start_timestamp,
+        "start_of_yesterday_timestamp": start_timestamp - _SECS_PER_DAY,
+        "default_today_query": _DEFAULT_TODAY_TPL.format(start_timestamp, start_timestamp + _SECS_PER_DAY - 1)
+    })
+    return genai.GenerativeModel(model_name, system_instruction=system_prompt)
+
 class TemporalAgentService(BaseLLMService):
     """
     Service for the Temporal Agent that generates SQL queries for time-based context.
@@ -27,9 +160,8 @@ class TemporalAgentService(BaseLLMService):
         """
         super().__init__(api_key, api_key_env_name="GEMINI_API_KEY1")
         self.model = model
-        print(self.api_key)
         # Configure the Gemini API
-        genai.configure(api_key=self.api_key)
+        ensure_configured(self.api_key)
     
     def generate_sql_query(self, prompt: str) -> str:
         """
@@ -41,71 +173,142 @@ class TemporalAgentService(BaseLLMService):
         Returns:
             Generated SQL query
         """
+        # Get current date info for context using GMT+7
+        current_time = datetime.now(GMT7)
+        start_timestamp, default_today_query = self._default_today_query(current_time)
+        
         try:
-            # Get current date info for context using GMT+7
-            current_time = datetime.now(GMT7)
-            date_context = {
-                "current_date": current_time.strftime("%Y-%m-%d"),
-                "current_day": current_time.strftime("%A"),
-                "current_month": current_time.strftime("%B"),
-                "current_year": current_time.year,
-                "current_timestamp": int(current_time.timestamp())
-            }
-            
-            # Calculate today's time range in GMT+7
-            start_of_day = datetime(current_time.year, current_time.month, current_time.day, 0, 0, 0, tzinfo=GMT7)
-            start_timestamp = int(start_of_day.timestamp())
-            
-            end_of_day = datetime(current_time.year, current_time.month, current_time.day, 23, 59, 59, tzinfo=GMT7)
-            end_timestamp = int(end_of_day.timestamp())
-            
-            # Default query for today if no time references found - use GMT+7 format
-            default_today_query = f"SELECT datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations WHERE timestamp >= {start_timestamp} AND timestamp <= {end_timestamp} ORDER BY timestamp ASC"
-            
-            # Create an enhanced prompt that instructs the agent
-            enhanced_prompt = f"""Analyze this user message and generate an appropriate SQL query to retrieve relevant conversations:
-            
-            User message: "{prompt}"
-
-            INSTRUCTIONS:
-            1. First, determine if this message contains ANY specific time references (like today, yesterday, May 10, last week, etc.)
-            2. If NO time references are found, return EXACTLY this query:
-               {default_today_query}
-            3. If time references ARE found, generate a SQL query that:
-               - Targets the specific time period mentioned
-               - Uses "SELECT datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations"
-               - Includes appropriate timestamp filters using WHERE clauses
-               - Orders by timestamp DESC
-               - Limits to 10 results
-
-            Your response should be ONLY THE SQL QUERY with no explanations or additional text."""
-
-            system_prompt = self._build_system_prompt(date_context, default_today_query)
-            model = genai.GenerativeModel(self.model, system_instruction=system_prompt)
+            request = self._build_sql_request(prompt, current_time, start_timestamp, default_today_query)
+            if request is None:
+                return default_today_query
+            model, enhanced_prompt = request
             
             # Generate the SQL query
             response = model.generate_content(
                 enhanced_prompt,
                 generation_config={"temperature": 0.01}  # Very low temperature for consistent output
             )
+            return self._finalize_sql_query(response.text, default_today_query)
             
-            # Clean the response
-            sql_query = self._clean_sql_response(response.text)
+        except Exception as e:
+            logger.error(f"Error generating SQL query: {e}")
+            # Return a safe default query in case of error
+            return default_today_query
             
+    async def generate_sql_query_async(self, prompt: str) -> str:
+        """
+        Generate a SQL query like generate_sql_query, using the Gemini async client.
+        
+        Args:
+            prompt: User's prompt text
             
-            # Validate the query
-            if not self._validate_sql_query(sql_query, allow_content=True):
-                # Default to today's query if validation fails
-                logger.warning(f"Generated SQL query failed validation: {sql_query}")
+        Returns:
+            Generated SQL query
+        """
+        current_time = datetime.now(GMT7)
+        start_timestamp, default_today_query = self._default_today_query(current_time)
+        
+        try:
+            request = self._build_sql_request(prompt, current_time, start_timestamp, default_today_query)
+            if request is None:
                 return default_today_query
+            model, enhanced_prompt = request
             
-            logger.info(f"Generated temporal query: {sql_query}")
-            return sql_query
+            response = await model.generate_content_async(
+                enhanced_prompt,
+                generation_config={"temperature": 0.01}
+            )
+            return self._finalize_sql_query(response.text, default_today_query)
             
         except Exception as e:
             logger.error(f"Error generating SQL query: {e}")
-            # Return a safe default query in case of error
-            return f"SELECT datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations WHERE timestamp >= {start_timestamp} AND timestamp <= {end_timestamp} ORDER BY timestamp ASC"
+            return default_today_query
+            
+    def _default_today_query(self, current_time: datetime) -> Tuple[int, str]:
+        """
+        Build the default query returning today's messages.
+        
+        Args:
+            current_time: Current datetime in GMT+7
+            
+        Returns:
+            Tuple of (start of day unix timestamp, query)
+        """
+        # Calculate today's time range in GMT+7
+        start_of_day = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        start_timestamp = int(start_of_day.timestamp())
+        end_timestamp = start_timestamp + _SECS_PER_DAY - 1
+        
+        return start_timestamp, _DEFAULT_TODAY_TPL.format(start_timestamp, end_timestamp)
+        
+    def _build_sql_request(self, 
+                           prompt: str, 
+                           current_time: datetime, 
+                           start_timestamp: int, 
+                           default_today_query: str) -> Optional[Tuple[genai.GenerativeModel, str]]:
+        """
+        Prepare the model and prompt for SQL generation.
+        
+        Args:
+            prompt: User's prompt text
+            current_time: Current datetime in GMT+7
+            start_timestamp: Unix timestamp of the start of today
+            default_today_query: The default query for today's messages
+            
+        Returns:
+            Tuple of (model, enhanced prompt), or None if the default query should be used as is
+        """
+        # Without a time reference the agent is told to return the default query
+        # verbatim, so skip the LLM round trip when no time word is present
+        if not has_time_reference(prompt):
+            logger.info("No time reference found, using today's query")
+            return None
+            
+        current_timestamp = int(current_time.timestamp())
+        
+        # Create an enhanced prompt that instructs the agent
+        enhanced_prompt = f"""Analyze this user message and generate an appropriate SQL query to retrieve relevant conversations:
+        
+        User message: "{prompt}"
+        Current unix timestamp: {current_timestamp}
+
+        INSTRUCTIONS:
+        1. First, determine if this message contains ANY specific time references (like today, yesterday, May 10, last week, etc.)
+        2. If NO time references are found, return EXACTLY this query:
+           {default_today_query}
+        3. If time references ARE found, generate a SQL query that:
+           - Targets the specific time period mentioned
+           - Uses "SELECT id, datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations"
+           - Includes appropriate timestamp filters using WHERE clauses
+           - Orders by timestamp DESC
+           - Limits to 10 results
+
+        Your response should be ONLY THE SQL QUERY with no explanations or additional text."""
+
+        return _get_sql_model(self.model, start_timestamp), enhanced_prompt
+        
+    def _finalize_sql_query(self, response_text: str, default_today_query: str) -> str:
+        """
+        Clean and validate the generated SQL query.
+        
+        Args:
+            response_text: Raw response from the agent
+            default_today_query: The default query for today's messages
+            
+        Returns:
+            The generated query, or the default query if it fails validation
+        """
+        # Clean the response
+        sql_query = self._clean_sql_response(response_text)
+        
+        # Validate the query
+        if not self._validate_sql_query(sql_query, allow_content=True):
+            # Default to today's query if validation fails
+            logger.warning(f"Generated SQL query failed validation: {sql_query}")
+            return default_today_query
+        
+        logger.info(f"Generated temporal query: {sql_query}")
+        return sql_query
     
     def _clean_sql_response(self, response_text: str) -> str:
         """
@@ -116,10 +319,9 @@ class TemporalAgentService(BaseLLMService):
         
         # If response is wrapped in code blocks, extract just the SQL part
         if text.startswith("```sql"):
-            text = text.replace("```sql", "", 1)
-            text = text.replace("```", "", 1)
+            text = text.removeprefix("```sql").removesuffix("```")
         elif text.startswith("```"):
-            text = text.replace("```", "", 2)
+            text = text.removeprefix("```").removesuffix("```")
         
         return text.strip()
     
@@ -134,78 +336,21 @@ class TemporalAgentService(BaseLLMService):
         Returns:
             True if valid, False otherwise
         """
-        sql_lower = sql_query.lower()
-        if not sql_lower.startswith("select "):
+        if not _VALID_RE.match(sql_query):
             return False
-        if "datetime(timestamp, 'unixepoch', '+7 hours') as datetime" not in sql_lower:
-            return False
-        if "role" not in sql_lower:
-            return False        
-        if "from conversations" not in sql_lower:
-            return False
-        has_content = "content" in sql_lower.split("where")[0] if "where" in sql_lower else "content" in sql_lower
-        if has_content and not allow_content:
+        if not allow_content and _CONTENT_BEFORE_WHERE_RE.match(sql_query):
             return False
             
         return True
     
-    def _build_system_prompt(self, date_context: Dict[str, Any], default_today_query: str) -> str:
+    def generate_response(self, prompt: str, **kwargs) -> str:
         """
-        Build a system prompt for SQL query generation.
-        
-        Args:
-            date_context: Dictionary with current date information
-            default_today_query: The default query for today's messages
-            
-        Returns:
-            Formatted system prompt text
+        This method is kept for backward compatibility but now just calls generate_sql_query
         """
-        current_date = date_context["current_date"]
-        current_day = date_context["current_day"]
-        current_month = date_context["current_month"]
-        current_year = date_context["current_year"]
-        current_timestamp = date_context["current_timestamp"]
+        return self.generate_sql_query(prompt)
         
-        return f"""You are a specialized SQL query generator for retrieving conversation records from a database.
-        Your task is to convert user messages into precise SQL queries for a conversations database.
-
-        TODAY'S DATE: {current_date} ({current_day}, {current_month} {current_year})
-        CURRENT UNIX TIMESTAMP: {current_timestamp}
-
-        DATABASE SCHEMA:
-        - Table name: conversations
-        - Columns: timestamp (REAL, unix timestamp), role (TEXT, either 'user' or 'assistant'), content (TEXT, message content)
-
-        CRITICAL INSTRUCTIONS:
-        1. Look for ANY time references in the user's message (today, yesterday, last week, May 10, etc.)
-        2. If NO time references are found in the message, ALWAYS return EXACTLY this query:
-           {default_today_query}
-        3. If time references ARE found, generate a time-specific query following these rules:
-           - Use "SELECT datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations"
-           - Include WHERE clauses to filter by the appropriate time range
-           - Use ORDER BY timestamp DESC LIMIT 10
-
-        IMPORTANT:
-        - Your output must be ONLY the SQL query with NO additional text
-        - Do not include explanations, comments, or markdown in your response
-        - When there are no time references, default to today's query EXACTLY as provided
-        - NEVER modify the default today query's format - it must be used exactly as shown
-        - ALWAYS include the content column in all queries
-        - ALWAYS use '+7 hours' in the datetime function to use GMT+7 timezone
-
-        EXAMPLES:
-
-        User message: "What do you know about climate change?"
-        SQL (no time reference): {default_today_query}
-
-        User message: "What did we talk about yesterday?"
-        SQL (has time reference): SELECT datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations WHERE timestamp >= {current_timestamp - 86400} AND timestamp < {current_timestamp - 86400 + 86399} ORDER BY timestamp DESC LIMIT 10
-
-        User message: "Tell me what I asked about in May"
-        SQL (has time reference): SELECT datetime(timestamp, 'unixepoch', '+7 hours') as datetime, role, content FROM conversations WHERE timestamp >= strftime('%s', '2025-05-01 00:00:00') AND timestamp < strftime('%s', '2025-06-01 00:00:00') ORDER BY timestamp DESC LIMIT 10"""
-                
-    def generate_response(self, prompt: str, **kwargs) -> str:
+    async def generate_response_async(self, prompt: str, **kwargs) -> str:
         """
-        This method is kept for backward compatibility but now just calls generate_sql_query
+        Async counterpart of generate_response, calls generate_sql_query_async
         """
-        return self.generate_sql_query(prompt)
\ No newline at end of file
+        return await self.generate_sql_query_async(prompt)
@@ -2,18 +2,19 @@ import os
 import time
 import logging
 import uuid
+import threading
 import datetime
 from typing import List, Dict, Any, Optional, Union
 from datetime import timezone, timedelta
 
 import chromadb
 from chromadb.api.models import Collection
+from chromadb.errors import ChromaError
 import numpy as np
-from transformers import AutoTokenizer, AutoModel
-import torch
 
 # Import the custom embedding function
-from app.services.embedding_functions import VietnameseSBERTEmbeddingFunction
+from app.services.embedding_functions import get_embedding_function
+from app.services.config import SEMANTIC_COLLECTION_METADATA
 
 # Define GMT+7 timezone
 GMT7 = timezone(timedelta(hours=7))
@@ -40,23 +41,33 @@ class MemoryService:
         # Create directory if it doesn't exist
         os.makedirs(self.db_path, exist_ok=True)
         
-        embedding_func = VietnameseSBERTEmbeddingFunction()
+        embedding_func = get_embedding_function()
+        self.embedding_function = embedding_func
         
         # Initialize ChromaDB client
         self.client = chromadb.PersistentClient(path=self.db_path)
         
+        # The service is shared across requests; serialize collection mutations
+        self._write_lock = threading.Lock()
+        
         try:
-            # First try to get the existing collection without specifying the embedding function
-            self.collection = self.client.get_collection(name=self.collection_name)
+            # First try to get the existing collection
+            self.collection = self.client.get_collection(
+                name=self.collection_name,
+                embedding_function=embedding_func
+            )
             logger.info(f"Retrieved existing collection: {self.collection_name}")
         except Exception as e:
             logger.info(f"Creating new collection: {self.collection_name}")
             self.collection = self.client.create_collection(
                 name=self.collection_name,
                 embedding_function=embedding_func,
-                metadata={"hnsw:space": "cosine"}  # Explicitly set distance metric to cosine
+                metadata=SEMANTIC_COLLECTION_METADATA  # Inner product on unit-norm embeddings
             )
             
+        # Track the document count locally so queries against an empty collection skip Chroma entirely
+        self._document_count = self.collection.count()
+            
     def add_document(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> str:
         """
         Add a document to the vector store with automatic embedding.
@@ -68,28 +79,46 @@ class MemoryService:
         Returns:
             Document ID
         """
-        # Generate a unique ID if none provided in metadata
-        doc_id = str(uuid.uuid4())
-        
-        # Update metadata with timestamp if not present
-        if metadata is None:
-            metadata = {}
-        if 'timestamp' not in metadata:
-            metadata['timestamp'] = time.time()
+        # A single document is a batch of one, so it shares the batched embedding and write path
+        return self.add_documents_batch([text], [metadata if metadata is not None else {}])[0]
+            
+    def add_documents_batch(self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None) -> List[str]:
+        """
+        Add several documents to the vector store in a single call,
+        so they are embedded in one pass and written in one transaction.
         
-        # Add ISO format datetime if not present, using GMT+7 timezone
-        if 'datetime' not in metadata:
-            metadata['datetime'] = datetime.datetime.now(GMT7).isoformat()
+        Args:
+            texts: Text contents to be embedded and stored
+            metadatas: Optional metadata for each document
+            
+        Returns:
+            List of document IDs
+        """
+        if not texts:
+            return []
+            
+        doc_ids = [str(uuid.uuid4()) for _ in texts]
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+            
+        # Add timestamp and ISO format datetime (GMT+7) where not present
+        timestamp = time.time()
+        datetime_iso = datetime.datetime.now(GMT7).isoformat()
+        for metadata in metadatas:
+            metadata.setdefault('timestamp', timestamp)
+            metadata.setdefault('datetime', datetime_iso)
             
         try:
-            self.collection.add(
-                documents=[text],
-                metadatas=[metadata],
-                ids=[doc_id]
-            )
-            return doc_id
+            with self._write_lock:
+                self.collection.add(
+                    documents=texts,
+                    metadatas=metadatas,
+                    ids=doc_ids
+                )
+                self._document_count += len(doc_ids)
+            return doc_ids
         except Exception as e:
-            logger.error(f"Error adding document to vector store: {e}")
+            logger.error(f"Error adding documents to vector store: {e}")
             raise
             
     def query_similar_documents(self, 
@@ -110,38 +139,50 @@ class MemoryService:
         Returns:
             List of similar documents with their metadata
         """
+        # Nothing to search: skip the embedding forward pass and the ANN round-trip
+        if self._document_count == 0:
+            return []
+        # Asking for more neighbours than stored documents only makes Chroma warn and traverse the whole graph
+        n_results = min(n_results, self._document_count)
+            
         try:
+            # Embed through the shared embedding function so repeated prompts hit its LRU cache;
+            # Chroma's wrapper returns one array per text, so stack them before converting
+            query_embedding = np.asarray(self.embedding_function([query_text]), dtype=np.float32)
             results = self.collection.query(
-                query_texts=[query_text],
+                query_embeddings=query_embedding.tolist(),
                 n_results=n_results,
                 where=where,
                 include=["documents", "metadatas", "distances"]
             )
-            
-            # Format the results
-            formatted_results = []
-            for i, doc in enumerate(results['documents'][0]):
-                distance = results.get('distances', [[]])[0][i] if results.get('distances') else None
-                
-                # Convert distance to similarity score (cosine distance to cosine similarity)
-                similarity = 1 - distance if distance is not None else 0
-                
-                # Only include results that meet the similarity threshold
-                if similarity >= threshold:
-                    result = {
-                        'text': doc,
-                        'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                        'id': results['ids'][0][i],
-                        'similarity': similarity,
-                        'distance': distance
-                    }
-                    formatted_results.append(result)
-                
-            return formatted_results
-        except Exception as e:
+        except (ChromaError, ValueError, RuntimeError) as e:
+            # Store and model failures degrade to no semantic context; programming errors propagate
             logger.error(f"Error querying vector store: {e}")
             return []
             
+        docs = results['documents'][0]
+        if not docs:
+            return []
+        ids = results['ids'][0]
+        metadatas = results['metadatas'][0] if results.get('metadatas') else [{}] * len(docs)
+        
+        # Convert distance to similarity score (inner product and cosine distance are both 1 - similarity)
+        distances = np.asarray(results['distances'][0], dtype=np.float64) if results.get('distances') else None
+        similarities = 1 - distances if distances is not None else np.zeros(len(docs))
+        
+        # Only allocate result dicts for documents that meet the similarity threshold
+        keep = np.nonzero(similarities >= threshold)[0].tolist()
+        return [
+            {
+                'text': docs[i],
+                'metadata': metadatas[i],
+                'id': ids[i],
+                'similarity': float(similarities[i]),
+                'distance': float(distances[i]) if distances is not None else None
+            }
+            for i in keep
+        ]
+            
     def delete_document(self, doc_id: str) -> bool:
         """
         Delete a document from the vector store.
@@ -153,7 +194,9 @@ class MemoryService:
             Success status
         """
         try:
-            self.collection.delete(ids=[doc_id])
+            with self._write_lock:
+                self.collection.delete(ids=[doc_id])
+                self._document_count = self.collection.count()
             return True
         except Exception as e:
             logger.error(f"Error deleting document from vector store: {e}")
@@ -182,11 +225,12 @@ class MemoryService:
             if 'datetime' not in metadata:
                 metadata['datetime'] = datetime.datetime.now(GMT7).isoformat()
                 
-            self.collection.update(
-                ids=[doc_id],
-                documents=[text],
-                metadatas=[metadata]
-            )
+            with self._write_lock:
+                self.collection.update(
+                    ids=[doc_id],
+                    documents=[text],
+                    metadatas=[metadata]
+                )
             return True
         except Exception as e:
             logger.error(f"Error updating document in vector store: {e}")
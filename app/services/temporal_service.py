@@ -1,25 +1,150 @@
 import sqlite3
 import os
 import time
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator
 from datetime import datetime, timedelta, timezone
 import json
 import logging
+import queue
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-import torch 
 
-from app.services.embedding_functions import VietnameseSBERTEmbeddingFunction
+from app.services.embedding_functions import get_embedding_function
+from app.services.vector_ops import dot_similarities
+from app.services.config import (
+    SQLITE_PRAGMAS, SQLITE_CACHED_STATEMENTS, SQLITE_READER_POOL_SIZE, EMBEDDING_BATCH_SIZE,
+    RELEVANT_MESSAGES_TOP_K, TEMPORAL_EMBEDDING_CAPACITY
+)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional faster JSON backend
+    orjson = None
 
 # Define GMT+7 timezone
 GMT7 = timezone(timedelta(hours=7))
 
 logger = logging.getLogger(__name__)
 
+# Fixed statements, kept as constants so each is compiled once per connection and reused
+# from sqlite3's statement cache. The GMT+7 ISO datetime is formatted by SQLite instead of
+# per row in Python; rows formatted in Python use the same whole-second format.
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S+07:00'
+_MESSAGE_COLUMNS = (
+    "id, role, content, timestamp, metadata, "
+    f"strftime('{_DATETIME_FORMAT}', timestamp, 'unixepoch', '+7 hours') AS datetime"
+)
+_RECENT_MESSAGES_SQL = f"SELECT {_MESSAGE_COLUMNS} FROM conversations ORDER BY timestamp DESC, id DESC LIMIT ?"
+_ALL_MESSAGES_SQL = f"SELECT {_MESSAGE_COLUMNS} FROM conversations ORDER BY timestamp ASC, id ASC"
+_INSERT_MESSAGE_SQL = "INSERT INTO conversations (role, content, timestamp, metadata, embedding) VALUES (?, ?, ?, ?, ?)"
+_MISSING_EMBEDDINGS_SQL = "SELECT id, content FROM conversations WHERE embedding IS NULL ORDER BY id"
+_UPDATE_EMBEDDING_SQL = "UPDATE conversations SET embedding = ? WHERE id = ?"
+_ALL_EMBEDDINGS_SQL = "SELECT id, embedding FROM conversations WHERE embedding IS NOT NULL ORDER BY id"
+
+def _dumps_metadata(metadata: Dict[str, Any]) -> str:
+    """
+    Serialize message metadata to JSON text, using orjson when it is installed.
+    
+    Args:
+        metadata: Metadata dictionary
+        
+    Returns:
+        JSON string
+    """
+    if orjson is not None:
+        return orjson.dumps(metadata, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(metadata)
+
+# orjson parses the same JSON text as the stdlib, only faster
+_loads_metadata = orjson.loads if orjson is not None else json.loads
+
+@lru_cache(maxsize=128)
+def _localize_query(query: str) -> str:
+    """
+    Rewrite a query to format timestamps in GMT+7 instead of UTC.
+    Cached because the same few generated queries repeat across requests,
+    and the identical text lets sqlite3 reuse its compiled statement.
+    
+    Args:
+        query: SQL query string
+        
+    Returns:
+        The rewritten query string
+    """
+    return query.replace(
+        "datetime(timestamp, 'unixepoch')", 
+        "datetime(timestamp, 'unixepoch', '+7 hours')"
+    )
+
+class _ConnectionPool:
+    """
+    Bounded pool of SQLite connections shared by all threads.
+    Connections are opened on demand up to the pool size; once all of them are
+    in use, acquire waits for one to be returned.
+    """
+    
+    def __init__(self, connect: Callable[[], sqlite3.Connection], size: int):
+        """
+        Initialize an empty pool.
+        
+        Args:
+            connect: Opens a new connection
+            size: Maximum number of connections kept open
+        """
+        self._connect = connect
+        self._size = size
+        self._idle: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=size)
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        
+    @contextmanager
+    def acquire(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection for the duration of the with block.
+        
+        Yields:
+            SQLite connection object
+        """
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+            
+    def _checkout(self) -> sqlite3.Connection:
+        """
+        Take an idle connection, open a new one while below the pool size, or wait for one.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._connections) < self._size:
+                conn = self._connect()
+                self._connections.append(conn)
+                return conn
+        return self._idle.get()
+        
+    def close_all(self) -> None:
+        """
+        Close every connection opened by the pool.
+        """
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
 class TemporalService:
     """
     Service for managing temporal memory through SQLite database operations.
     Handles storage and retrieval of conversation history.
+    Writes go through a single autocommit connection serialized with a lock and open their
+    transaction explicitly; reads borrow read-only connections from a bounded pool, which WAL
+    lets run alongside the writer.
+    Message embeddings are stored with each row and kept in an in-memory matrix for scoring.
     """
     
     def __init__(self, db_path: str):
@@ -30,17 +155,24 @@ class TemporalService:
             db_path: Path to the SQLite database file
         """
         self.db_path = db_path
-        self.embedding_function = VietnameseSBERTEmbeddingFunction()
+        self.embedding_function = get_embedding_function()
+        self._lock = threading.RLock()
+        self._conn_pool = _ConnectionPool(self._open_reader, SQLITE_READER_POOL_SIZE)
+        # Decoded result of get_all_messages, kept in sync on write; None until first read
+        self._all_messages_cache: Optional[List[Dict[str, Any]]] = None
         self._ensure_db_exists()
+        self._backfill_embeddings()
+        self._init_embedding_matrix()
         
     def _ensure_db_exists(self) -> None:
         """
-        Create the database and necessary tables if they don't exist.
+        Create the database and necessary tables if they don't exist,
+        and open the shared connection.
         """
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self._conn = self._get_connection()
+        cursor = self._conn.cursor()
         
         # Create conversations table
         cursor.execute('''
@@ -49,21 +181,114 @@ class TemporalService:
             role TEXT NOT NULL,
             content TEXT NOT NULL,
             timestamp REAL NOT NULL,
-            metadata TEXT
+            metadata TEXT,
+            embedding BLOB
         )
         ''')
         
-        conn.commit()
-        conn.close()
+        # Databases created before embeddings were stored lack the column
+        columns = {row['name'] for row in cursor.execute("PRAGMA table_info(conversations)")}
+        if 'embedding' not in columns:
+            cursor.execute("ALTER TABLE conversations ADD COLUMN embedding BLOB")
+        
+        # Index the timestamp so recent/chronological reads are index scans instead of full sorts
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON conversations(timestamp)')
+        
+    def _backfill_embeddings(self) -> None:
+        """
+        Embed the messages saved before embeddings were stored with each row,
+        and save the result so they are not embedded again on the next start.
+        """
+        with self._lock:
+            rows = self._conn.execute(_MISSING_EMBEDDINGS_SQL).fetchall()
+        if not rows:
+            return
+            
+        for start in range(0, len(rows), EMBEDDING_BATCH_SIZE):
+            batch = rows[start:start + EMBEDDING_BATCH_SIZE]
+            embeddings = self._embed_messages([row['content'] for row in batch])
+            if embeddings is not None:
+                self._store_embeddings([row['id'] for row in batch], embeddings)
+        logger.info(f"Embedded {len(rows)} messages saved without an embedding")
+            
+    def _store_embeddings(self, ids: List[int], embeddings: np.ndarray) -> None:
+        """
+        Save embeddings for existing messages.
+        
+        Args:
+            ids: Row IDs of the messages
+            embeddings: Embeddings of the messages, in the same order
+        """
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                cursor.executemany(
+                    _UPDATE_EMBEDDING_SQL,
+                    [(embedding.tobytes(), row_id) for row_id, embedding in zip(ids, embeddings)]
+                )
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            
+    def _embed_messages(self, contents: List[str]) -> Optional[np.ndarray]:
+        """
+        Embed message contents in one batch.
         
+        Args:
+            contents: Text content of the messages
+            
+        Returns:
+            float32 array of unit-norm embeddings, or None if embedding failed
+        """
+        if not contents:
+            return np.empty((0, self.embedding_function.embedding_dim), dtype=np.float32)
+        try:
+            return np.ascontiguousarray(self.embedding_function(contents), dtype=np.float32)
+        except Exception as e:
+            logger.error(f"Error embedding messages: {e}")
+            return None
+            
     def _get_connection(self) -> sqlite3.Connection:
         """
-        Get a connection to the SQLite database.
+        Open a connection to the SQLite database with WAL and performance pragmas applied.
         
         Returns:
             SQLite connection object
         """
-        return sqlite3.connect(self.db_path)
+        # Autocommit mode: reads run without an implicit transaction, writes use explicit BEGIN/COMMIT
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None,
+                               cached_statements=SQLITE_CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+        
+    def _open_reader(self) -> sqlite3.Connection:
+        """
+        Open a read-only connection for the reader pool.
+        query_only also keeps generated SQL passed to execute_sql_query from modifying data.
+        
+        Returns:
+            SQLite connection object
+        """
+        conn = self._get_connection()
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+        
+    def close(self) -> None:
+        """
+        Refresh the query planner statistics and close all connections.
+        """
+        with self._lock:
+            try:
+                # Lets SQLite re-analyze tables whose shape changed so the planner keeps choosing idx_timestamp
+                self._conn.execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                logger.warning(f"PRAGMA optimize failed: {e}")
+            self._conn_pool.close_all()
+            self._conn.close()
         
     def save_interaction(self, content: str, role: str = "user", 
                          metadata: Optional[Dict[str, Any]] = None) -> int:
@@ -78,25 +303,65 @@ class TemporalService:
         Returns:
             The ID of the inserted row
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        timestamp = time.time()
-        metadata_json = json.dumps(metadata) if metadata else None
-        
-        cursor.execute(
-            '''
-            INSERT INTO conversations (role, content, timestamp, metadata)
-            VALUES (?, ?, ?, ?)
-            ''',
-            (role, content, timestamp, metadata_json)
-        )
+        # A single interaction is a batch of one, so it shares the batched insert path
+        return self.save_interactions_batch([(content, role)], [metadata])[0]
+    
+    def save_interactions_batch(self, interactions: List[Tuple[str, str]],
+                                metadatas: Optional[List[Optional[Dict[str, Any]]]] = None) -> List[int]:
+        """
+        Save several interactions to the database in a single transaction.
         
-        row_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        Args:
+            interactions: List of (content, role) tuples, in conversation order
+            metadatas: Optional additional metadata for each interaction
+            
+        Returns:
+            The IDs of the inserted rows
+        """
+        if not interactions:
+            return []
+        if metadatas is None:
+            metadatas = [None] * len(interactions)
+            
+        # Embed before taking the lock so the forward pass does not block readers
+        embeddings = self._embed_messages([content for content, _ in interactions])
+        blobs = [embedding.tobytes() for embedding in embeddings] if embeddings is not None else [None] * len(interactions)
+            
+        rows = [
+            (role, content, time.time(), _dumps_metadata(metadata) if metadata else None, blob)
+            for (content, role), metadata, blob in zip(interactions, metadatas, blobs)
+        ]
         
-        return row_id
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                cursor.executemany(_INSERT_MESSAGE_SQL, rows)
+                # Rows inserted within one transaction get consecutive ids
+                last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            
+            row_ids = list(range(last_id - len(rows) + 1, last_id + 1))
+            
+            # New rows are the latest, so appending keeps the cached history in chronological order
+            if self._all_messages_cache is not None:
+                self._all_messages_cache.extend(
+                    {
+                        'id': row_id,
+                        'role': role,
+                        'content': content,
+                        'timestamp': timestamp,
+                        'datetime': datetime.fromtimestamp(timestamp, tz=GMT7).strftime(_DATETIME_FORMAT),
+                        'metadata': dict(metadata) if metadata else {}
+                    }
+                    for row_id, (role, content, timestamp, _, _), metadata in zip(row_ids, rows, metadatas)
+                )
+            
+        self._append_embeddings(row_ids, embeddings)
+        return row_ids
     
     def get_recent_messages(self, count: int = 4) -> List[Dict[str, Any]]:
         """
@@ -108,36 +373,21 @@ class TemporalService:
         Returns:
             List of message dictionaries
         """
-        conn = self._get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        query = '''
-        SELECT id, role, content, timestamp, metadata
-        FROM conversations
-        ORDER BY timestamp DESC LIMIT ?
-        '''
-        
-        cursor.execute(query, (count,))
-        rows = cursor.fetchall()
+        with self._conn_pool.acquire() as conn:
+            rows = conn.execute(_RECENT_MESSAGES_SQL, (count,)).fetchall()
         
         # Convert to list of dictionaries
-        messages = []
-        for row in rows:
-            # Create datetime with GMT+7 timezone
-            dt = datetime.fromtimestamp(row['timestamp'], tz=GMT7)
-            
-            message = {
+        messages = [
+            {
                 'id': row['id'],
                 'role': row['role'],
                 'content': row['content'],
                 'timestamp': row['timestamp'],
-                'datetime': dt.isoformat(),
-                'metadata': json.loads(row['metadata']) if row['metadata'] else {}
+                'datetime': row['datetime'],
+                'metadata': _loads_metadata(row['metadata']) if row['metadata'] else {}
             }
-            messages.append(message)
-            
-        conn.close()
+            for row in rows
+        ]
         
         return list(reversed(messages)) 
     
@@ -153,114 +403,183 @@ class TemporalService:
             List of results as dictionaries
         """
         # Modify the query to use localtime instead of UTC
-        query = query.replace(
-            "datetime(timestamp, 'unixepoch')", 
-            "datetime(timestamp, 'unixepoch', '+7 hours')"
-        )
-        
-        conn = self._get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        query = _localize_query(query)
         
         try:
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
+            with self._conn_pool.acquire() as conn:
+                cursor = conn.execute(query, params)
+                # Column names are read once per query instead of calling row.keys() per row;
+                # raw embedding bytes are internal and not JSON-serializable, so they are dropped
+                columns = [column[0] for column in cursor.description or ()]
+                if 'embedding' in columns:
+                    keep = [i for i, column in enumerate(columns) if column != 'embedding']
+                    names = [columns[i] for i in keep]
+                    results = [dict(zip(names, [row[i] for i in keep])) for row in cursor.fetchall()]
+                else:
+                    names = columns
+                    results = [dict(zip(names, row)) for row in cursor.fetchall()]
             
-            # Convert rows to dictionaries
-            results = []
-            for row in rows:
-                result = {key: row[key] for key in row.keys()}
-                
+            has_metadata = 'metadata' in names
+            needs_datetime = 'timestamp' in names and 'datetime' not in names
+            for result in results:
                 # Parse metadata if present
-                if 'metadata' in result and result['metadata']:
-                    result['metadata'] = json.loads(result['metadata'])
-                else:
-                    result['metadata'] = {}
+                result['metadata'] = _loads_metadata(result['metadata']) if has_metadata and result['metadata'] else {}
                     
                 # Add formatted datetime if timestamp exists but not already converted by SQL
-                if 'timestamp' in result and 'datetime' not in result:
+                if needs_datetime:
                     dt = datetime.fromtimestamp(result['timestamp'], tz=GMT7)
-                    result['datetime'] = dt.isoformat()
-                    
-                results.append(result)
+                    result['datetime'] = dt.strftime(_DATETIME_FORMAT)
                 
-            conn.close()
             return results
             
         except sqlite3.Error as e:
             logger.error(f"SQLite error: {e}")
-            conn.close()
             return []
 
     def get_all_messages(self) -> List[Dict[str, Any]]:
         """
         Get all messages from the database in chronological order.
+        The table is read and decoded once; later writes append to the cached list.
         
         Returns:
             List of all message dictionaries
         """
-        conn = self._get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        query = '''
-        SELECT id, role, content, timestamp, metadata
-        FROM conversations
-        ORDER BY timestamp ASC
-        '''
+        with self._lock:
+            if self._all_messages_cache is None:
+                rows = self._conn.execute(_ALL_MESSAGES_SQL).fetchall()
+                
+                # Convert to list of dictionaries
+                self._all_messages_cache = [
+                    {
+                        'id': row['id'],
+                        'role': row['role'],
+                        'content': row['content'],
+                        'timestamp': row['timestamp'],
+                        'datetime': row['datetime'],
+                        'metadata': _loads_metadata(row['metadata']) if row['metadata'] else {}
+                    }
+                    for row in rows
+                ]
+                
+            # Copy the list so callers cannot reorder or truncate the cache
+            return list(self._all_messages_cache)
+    
+    def get_all_embeddings(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the stored embeddings of all messages as one contiguous matrix.
         
-        cursor.execute(query)
-        rows = cursor.fetchall()
+        Returns:
+            Tuple of (row IDs, (N, D) float32 matrix of unit-norm embeddings) in id order
+        """
+        with self._conn_pool.acquire() as conn:
+            rows = conn.execute(_ALL_EMBEDDINGS_SQL).fetchall()
+            
+        ids = np.fromiter((row['id'] for row in rows), dtype=np.int64, count=len(rows))
+        matrix = np.frombuffer(b"".join(row['embedding'] for row in rows), dtype=np.float32)
+        return ids, matrix.reshape(len(rows), self.embedding_function.embedding_dim)
+    
+    def _get_stored_embeddings(self, ids: List[Any]) -> Tuple[List[int], np.ndarray]:
+        """
+        Look up the stored embeddings of specific messages in the in-memory embedding matrix.
         
-        # Convert to list of dictionaries
-        messages = []
-        for row in rows:
-            # Create datetime with GMT+7 timezone
-            dt = datetime.fromtimestamp(row['timestamp'], tz=GMT7)
+        Args:
+            ids: Row IDs of the messages; entries that are not integers are ignored
             
-            message = {
-                'id': row['id'],
-                'role': row['role'],
-                'content': row['content'],
-                'timestamp': row['timestamp'],
-                'datetime': dt.isoformat(),
-                'metadata': json.loads(row['metadata']) if row['metadata'] else {}
-            }
-            messages.append(message)
+        Returns:
+            Tuple of (IDs of the messages that have an embedding, matrix of their embeddings in that order)
+        """
+        ids = [row_id for row_id in ids if isinstance(row_id, int)]
+        dim = self.embedding_function.embedding_dim
+        if not ids:
+            return [], np.empty((0, dim), dtype=np.float32)
             
-        conn.close()
+        query = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            known = self._emb_ids[:self._emb_count]
+            if len(known) == 0:
+                return [], np.empty((0, dim), dtype=np.float32)
+            # Row ids are appended in increasing order, so the id array stays sorted
+            positions = np.minimum(np.searchsorted(known, query), len(known) - 1)
+            found = known[positions] == query
+            # Fancy indexing copies the rows, so the result stays valid after the lock is released
+            matrix = self._emb_matrix[positions[found]]
+        return query[found].tolist(), matrix
         
-        return messages
-    
-
-    def _get_embedding(self, text: str) -> np.ndarray:
-        """Tokenize and get the embedding for a given text using Vietnamese SBERT."""
-        # Use the embedding function to get embeddings
-        return self.embedding_function([text])[0]
+    def _init_embedding_matrix(self) -> None:
+        """
+        Candidates are scored by brute force, so keep all stored message embeddings in one
+        contiguous in-memory matrix, grown by doubling on write, instead of reading them
+        from the database on every query.
+        """
+        ids, matrix = self.get_all_embeddings()
+        capacity = max(TEMPORAL_EMBEDDING_CAPACITY, 2 * len(ids))
+        self._emb_ids = np.empty(capacity, dtype=np.int64)
+        self._emb_matrix = np.empty((capacity, self.embedding_function.embedding_dim), dtype=np.float32)
+        self._emb_ids[:len(ids)] = ids
+        self._emb_matrix[:len(ids)] = matrix
+        self._emb_count = len(ids)
+        
+    def _append_embeddings(self, ids: List[int], embeddings: Optional[np.ndarray]) -> None:
+        """
+        Append the embeddings of newly saved messages to the in-memory embedding matrix.
+        
+        Args:
+            ids: Row IDs of the messages, larger than any already stored
+            embeddings: Embeddings of the messages, in the same order
+        """
+        if embeddings is None or not ids:
+            return
+        with self._lock:
+            end = self._emb_count + len(ids)
+            if end > len(self._emb_ids):
+                capacity = max(end, 2 * len(self._emb_ids))
+                self._emb_ids = np.resize(self._emb_ids, capacity)
+                grown = np.empty((capacity, self._emb_matrix.shape[1]), dtype=np.float32)
+                grown[:self._emb_count] = self._emb_matrix[:self._emb_count]
+                self._emb_matrix = grown
+            self._emb_ids[self._emb_count:end] = ids
+            self._emb_matrix[self._emb_count:end] = embeddings
+            self._emb_count = end
 
-    def filter_relevant_messages(self, query: str, messages: List[Dict[str, Any]], threshold : float = 0.4) -> List[Dict[str, Any]]:
+    def filter_relevant_messages(self, query: str, messages: List[Dict[str, Any]], threshold : float = 0.4,
+                                 top_k: int = RELEVANT_MESSAGES_TOP_K) -> List[Dict[str, Any]]:
         """
         Filter messages based on relevance to the query using cosine similarity.
         Use keepitreal/vietnamese-sbert model for embeddings.
+        Candidates are scored with a batched dot product over their stored embeddings,
+        embedding in one batch only the messages that have none. At most top_k messages
+        are returned.
         """
-        query_embedding = self._get_embedding(query)
-        relevant_messages = []
-
+        if not messages:
+            return []
+        # Skip empty messages and repeats of the same content, keeping the first occurrence
+        unique = {}
         for msg in messages:
             content = msg.get('content', '')
-            if not content:
-                continue
+            if content and content not in unique:
+                unique[content] = msg
+        candidates = list(unique.values())
+        if not candidates:
+            return []
 
-            msg_embedding = self._get_embedding(content)
-            similarity = cosine_similarity([query_embedding], [msg_embedding])[0][0]
-            # print(f"Similarity: {similarity:.4f} for message: {content[:50]}...")
-            if similarity >= threshold:
-                print(f"Similarity: {similarity:.4f} for message: {content[:50]}...")
-                msg_with_score = msg.copy()
-                msg_with_score['similarity'] = float(similarity)
-                relevant_messages.append(msg_with_score)
+        query_embedding = self.embedding_function([query])[0]
 
-        # Sort messages by similarity score in descending order
-        relevant_messages.sort(key=lambda x: x['similarity'], reverse=True)
-        return relevant_messages
+        # Reuse the embeddings stored with the rows; only messages without one go through the model
+        found_ids, stored = self._get_stored_embeddings([msg.get('id') for msg in candidates])
+        position = {row_id: n for n, row_id in enumerate(found_ids)}
+        have = [i for i, msg in enumerate(candidates) if msg.get('id') in position]
+        missing = [i for i, msg in enumerate(candidates) if msg.get('id') not in position]
+        parts = []
+        if have:
+            parts.append(stored[[position[candidates[i]['id']] for i in have]])
+        if missing:
+            parts.append(np.asarray(self.embedding_function([candidates[i]['content'] for i in missing]), dtype=np.float32))
+        idx = np.asarray(have + missing)
+        sims = np.asarray(dot_similarities(query_embedding, np.concatenate(parts)), dtype=np.float32)
 
+        # Threshold, select the top_k in O(N) with argpartition, then sort only those by descending similarity
+        keep = np.nonzero(sims >= threshold)[0]
+        if len(keep) > top_k:
+            keep = keep[np.argpartition(-sims[keep], top_k - 1)[:top_k]]
+        order = keep[np.argsort(-sims[keep], kind="stable")]
+        return [{**candidates[i], 'similarity': float(similarity)} for i, similarity in zip(idx[order].tolist(), sims[order].tolist())]
@@ -0,0 +1,35 @@
+"""
+Vector similarity helpers shared by the memory services.
+Uses SimSIMD kernels when the package is installed and falls back to NumPy otherwise.
+"""
+
+import numpy as np
+
+try:
+    import simsimd
+except ImportError:  # pragma: no cover - optional accelerated backend
+    simsimd = None
+
+
+def dot_similarities(query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """
+    Compute the similarity between one query vector and every row of a matrix.
+    Embeddings are stored unit-norm, so cosine similarity reduces to a dot product.
+    
+    Args:
+        query: Unit-norm query vector of shape (D,)
+        matrix: Unit-norm candidate vectors of shape (N, D)
+        
+    Returns:
+        Array of N similarity scores
+    """
+    # Contiguous float32 buffers let SimSIMD use its SIMD FP32 kernels
+    query = np.ascontiguousarray(query, dtype=np.float32)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.shape[0] == 0:
+        return np.empty(0, dtype=np.float32)
+        
+    if simsimd is not None:
+        return np.asarray(simsimd.cdist(query[np.newaxis], matrix, metric="dot"), dtype=np.float32)[0]
+        
+    return matrix @ query
@@ -8,8 +8,10 @@ import os
 import uvicorn
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Load environment variables from a local .env file; without one, rely on the real environment
+# instead of letting load_dotenv search parent directories on every (re)start
+if os.path.exists(".env"):
+    load_dotenv(".env")
 
 # Get host and port from environment variables or use defaults
 host = os.getenv("HOST", "127.0.0.1")
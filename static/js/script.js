@@ -109,11 +109,12 @@ function submitChatForm() {
     }
 }
 
-// Send chat request to the API
+// Send chat request to the API and render the response as it streams in
 async function sendChatRequest(prompt) {
     isWaitingForResponse = true;
+    let contentDiv = null;
     try {
-        const response = await fetch('/api/chat', {
+        const response = await fetch('/api/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -128,17 +129,44 @@ async function sendChatRequest(prompt) {
             throw new Error(`HTTP error: ${response.status}`);
         }
         
-        const data = await response.json();
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let responseText = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            
+            buffer += decoder.decode(value, { stream: true });
+            
+            // Server-Sent Events are separated by a blank line
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            
+            for (const event of events) {
+                if (!event.startsWith('data: ')) continue;
+                const data = JSON.parse(event.slice(6));
+                
+                if (data.type === 'chunk') {
+                    // Replace the loading indicator with the message on the first chunk
+                    if (contentDiv === null) {
+                        removeLoadingIndicator();
+                        contentDiv = addMessageToChat('assistant', '');
+                    }
+                    responseText += data.text;
+                    contentDiv.innerHTML = `<p>${formatContent(responseText)}</p>`;
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                } else if (data.type === 'done') {
+                    // Update memory insights if available
+                    updateMemoryInsights(data.temporal_context, data.semantic_context);
+                }
+            }
+        }
         
         // Remove loading indicator
         removeLoadingIndicator();
         
-        // Display the assistant's response
-        addMessageToChat('assistant', data.response_text);
-        
-        // Update memory insights if available
-        updateMemoryInsights(data.temporal_context, data.semantic_context);
-        
     } catch (error) {
         console.error('Error sending chat request:', error);
         
@@ -152,7 +180,16 @@ async function sendChatRequest(prompt) {
     }
 }
 
-// Add a message to the chat display
+// Process content for markdown-like formatting (very simple version)
+function formatContent(content) {
+    return content
+        .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')  // Bold
+        .replace(/\*(.*?)\*/g, '<em>$1</em>')              // Italic
+        .replace(/`(.*?)`/g, '<code>$1</code>')            // Code
+        .replace(/\n/g, '<br>');                          // Line breaks
+}
+
+// Add a message to the chat display and return its content element
 function addMessageToChat(role, content) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${role}`;
@@ -160,20 +197,15 @@ function addMessageToChat(role, content) {
     const contentDiv = document.createElement('div');
     contentDiv.className = 'message-content';
     
-    // Process content for markdown-like formatting (very simple version)
-    const formattedContent = content
-        .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')  // Bold
-        .replace(/\*(.*?)\*/g, '<em>$1</em>')              // Italic
-        .replace(/`(.*?)`/g, '<code>$1</code>')            // Code
-        .replace(/\n/g, '<br>');                          // Line breaks
-    
-    contentDiv.innerHTML = `<p>${formattedContent}</p>`;
+    contentDiv.innerHTML = `<p>${formatContent(content)}</p>`;
     messageDiv.appendChild(contentDiv);
     
     chatMessages.appendChild(messageDiv);
     
     // Scroll to bottom
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    
+    return contentDiv;
 }
 
 // Show loading indicator